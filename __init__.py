@@ -1,7 +1,8 @@
-__init.py__
+"""__init.py__
 src/
     connector.py
     cos_sim.py
     crawler.py
     parsers.py
-    utils.py
\ No newline at end of file
+    utils.py
+"""
@@ -0,0 +1,165 @@
+import hashlib
+import html
+import io
+import random
+from zipfile import ZipFile, ZIP_DEFLATED
+
+import openpyxl
+import xlwt
+from docx import Document
+
+
+# словарь для названий таблиц, похожих на названия таблиц Росстата
+SUBJECTS = ('численность', 'среднемесячная номинальная начисленная заработная плата', 'индексы потребительских цен',
+            'объем отгруженных товаров', 'ввод в действие жилых домов', 'оборот розничной торговли',
+            'инвестиции в основной капитал', 'уровень безработицы', 'производство основных видов продукции',
+            'внешнеторговый оборот', 'естественное движение населения', 'посевные площади')
+OBJECTS = ('населения', 'работников организаций', 'на товары и услуги', 'собственного производства',
+           'предприятий и организаций', 'сельскохозяйственных культур', 'малых предприятий',
+           'по видам экономической деятельности', 'домашних хозяйств', 'в фактически действовавших ценах')
+SCOPES = ('по субъектам Российской Федерации', 'по федеральным округам', 'по городским округам',
+          'в городской и сельской местности', 'по полу и возрасту', 'по месяцам', 'по формам собственности')
+UNITS = ('тыс. человек', 'млн рублей', 'рублей', 'в процентах', 'тыс. кв. м', 'тонн', 'единиц')
+
+# размеры таблиц в строках
+SIZES = {'small': 20, 'medium': 200, 'large': 2000}
+N_COLUMNS = 8
+
+MIME_TYPES = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'xls': 'application/vnd.ms-excel',
+    'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'htm': 'text/html; charset=windows-1251',
+    'zip': 'application/zip',
+}
+KINDS = tuple(MIME_TYPES)
+
+
+def generate_table_name(rng, number=None):
+    name = f'{rng.choice(SUBJECTS)} {rng.choice(OBJECTS)} {rng.choice(SCOPES)} ({rng.choice(UNITS)})'
+    name = name[0].upper() + name[1:]
+    if number is not None:
+        name = f'{number}. {name}'
+    return name
+
+
+def generate_table_names(n, seed=0):
+    rng = random.Random(seed)
+    return [generate_table_name(rng, f'{rng.randint(1, 30)}.{rng.randint(1, 40)}') for _ in range(n)]
+
+
+def generate_rows(rng, n_rows):
+    header = ['Показатель'] + [str(year) for year in range(2015, 2015 + N_COLUMNS - 1)]
+    rows = [header]
+    for i in range(n_rows - 1):
+        rows.append([f'Строка {i + 1}'] + [round(rng.uniform(0, 100000), 1) for _ in range(N_COLUMNS - 1)])
+    return rows
+
+
+def generate_xlsx(rng, n_tables, n_rows):
+    workbook = openpyxl.Workbook()
+    workbook.remove(workbook.active)
+    for i in range(n_tables):
+        worksheet = workbook.create_sheet(f'Таблица {i + 1}')
+        worksheet.append([generate_table_name(rng, f'{i + 1}.1')])
+        worksheet.append([])
+        for row in generate_rows(rng, n_rows):
+            worksheet.append(row)
+    binary = io.BytesIO()
+    workbook.save(binary)
+    return binary.getvalue()
+
+
+def generate_xls(rng, n_tables, n_rows):
+    workbook = xlwt.Workbook(encoding='utf-8')
+    for i in range(n_tables):
+        worksheet = workbook.add_sheet(f'Таблица {i + 1}')
+        worksheet.write(0, 0, generate_table_name(rng, f'{i + 1}.1'))
+        # у xls не более 65536 строк на листе
+        for r, row in enumerate(generate_rows(rng, min(n_rows, 65000)), start=2):
+            for c, value in enumerate(row):
+                worksheet.write(r, c, value)
+    binary = io.BytesIO()
+    workbook.save(binary)
+    return binary.getvalue()
+
+
+def generate_docx(rng, n_tables, n_rows):
+    document = Document()
+    for i in range(n_tables):
+        document.add_paragraph(f'Таблица {i + 1}')
+        document.add_paragraph(generate_table_name(rng))
+        rows = generate_rows(rng, n_rows)
+        table = document.add_table(rows=len(rows), cols=N_COLUMNS)
+        for table_row, row in zip(table.rows, rows):
+            for cell, value in zip(table_row.cells, row):
+                cell.text = str(value)
+        document.add_paragraph('')
+    binary = io.BytesIO()
+    document.save(binary)
+    return binary.getvalue()
+
+
+def generate_htm(rng, n_tables, n_rows):
+    parts = ['<html><head><title>Росстат</title></head><body>']
+    for i in range(n_tables):
+        parts.append(f'<h2>{html.escape(generate_table_name(rng, f"{i + 1}.1"))}</h2>')
+        parts.append('<table>')
+        for row in generate_rows(rng, n_rows):
+            parts.append('<tr>' + ''.join(f'<td><p>{value}</p></td>' for value in row) + '</tr>')
+        parts.append('</table>')
+    parts.append('</body></html>')
+    return ''.join(parts).encode('cp1251')
+
+
+def generate_zip(rng, n_tables, n_rows, depth=2):
+    """архив с файлами всех видов и вложенным архивом глубины depth - 1"""
+    binary = io.BytesIO()
+    with ZipFile(binary, 'w', ZIP_DEFLATED) as zip_file:
+        for kind in ('xlsx', 'xls', 'docx', 'htm'):
+            zip_file.writestr(f'tables.{kind}', GENERATORS[kind](rng, n_tables, n_rows))
+        if depth > 1:
+            zip_file.writestr('nested.zip', generate_zip(rng, n_tables, n_rows, depth - 1))
+    return binary.getvalue()
+
+
+GENERATORS = {
+    'xlsx': generate_xlsx,
+    'xls': generate_xls,
+    'docx': generate_docx,
+    'htm': generate_htm,
+    'zip': generate_zip,
+}
+
+
+def generate_corpus(files_per_size=2, sizes=SIZES, n_tables=3, seed=0):
+    """детерминированный набор записей графа: для каждого вида файлов и размера таблиц files_per_size файлов;
+    записи имеют те же поля, что и public.graph"""
+    rng = random.Random(seed)
+    graph_records = []
+    for kind in KINDS:
+        for size, n_rows in sizes.items():
+            for i in range(files_per_size):
+                binary = GENERATORS[kind](rng, n_tables, n_rows)
+                graph_id = len(graph_records) + 1
+                path = f'https://rosstat.gov.ru/storage/mediabank/{kind}/{size}_{i}.{kind}'
+                graph_records.append({
+                    'id': graph_id,
+                    'rootname': 'https://rosstat.gov.ru/',
+                    'level': 2,
+                    'name': f'{size}_{i}.{kind}',
+                    'path': path,
+                    'redirect': None,
+                    'parent': f'https://rosstat.gov.ru/folder/{kind}',
+                    'type': MIME_TYPES[kind],
+                    'done': True,
+                    'hash': hashlib.md5(binary).hexdigest(),
+                    'href': path,
+                    'timestamp': '2021-01-01 00:00:00',
+                    'file': binary,
+                    'document': None,
+                    # поля только для отчета бенчмарка
+                    'kind': kind,
+                    'size': size,
+                })
+    return graph_records
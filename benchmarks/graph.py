@@ -0,0 +1,63 @@
+import sqlite3
+
+from src.connector import GRAPH_METADATA
+from src.utils import chunked
+
+
+class SQLiteGraph:
+    """замена Graph для бенчмарков: таблица graph той же структуры в файле SQLite;
+    реализует методы Graph, которые используются при обходе графа"""
+
+    def __init__(self, path=':memory:'):
+        self.connector = sqlite3.connect(path)
+        columns = ', '.join(attr for attr in GRAPH_METADATA if attr != 'id')
+        self.connector.execute(f'CREATE TABLE IF NOT EXISTS graph (id INTEGER PRIMARY KEY, {columns}, '
+                               'file BLOB, document TEXT);')
+
+    def insert_graph_records(self, graph_records):
+        attributes = GRAPH_METADATA + ('file', 'document')
+        placeholders = ', '.join('?' * len(attributes))
+        self.connector.executemany(f'INSERT OR REPLACE INTO graph ({", ".join(attributes)}) '
+                                   f'VALUES ({placeholders});',
+                                   [tuple(graph_record[attr] for attr in attributes) for graph_record in graph_records])
+        self.connector.commit()
+
+    def get_graph_record(self, graph_id, lazy=False):
+        cursor = self.connector.execute(f'SELECT {self.__generate_attributes_to_read(lazy)} '
+                                        'FROM graph WHERE id = ?;', (graph_id,))
+        attribute_values = cursor.fetchone()
+        if attribute_values is None:
+            raise ValueError(f'graph.id {graph_id} не существует в таблице')
+        attribute_names = [desc[0] for desc in cursor.description]
+        return dict(zip(attribute_names, attribute_values))
+
+    def iter_graph_records(self, ids, batch_size=100, lazy=False):
+        # порядок id сохраняется, как в Graph.iter_graph_records
+        for batch in chunked(dict.fromkeys(ids), batch_size):
+            placeholders = ', '.join('?' * len(batch))
+            cursor = self.connector.execute(f'SELECT {self.__generate_attributes_to_read(lazy)} '
+                                            f'FROM graph WHERE id IN ({placeholders});', batch)
+            attribute_names = [desc[0] for desc in cursor.description]
+            graph_records = {graph_record['id']: graph_record for graph_record in
+                             (dict(zip(attribute_names, attribute_values)) for attribute_values in cursor)}
+            for graph_id in batch:
+                yield graph_id, graph_records.get(graph_id)
+
+    def load_blobs(self, graph_nodes):
+        graph_nodes_by_id = {graph_node.id: graph_node for graph_node in graph_nodes
+                             if not graph_node.blobs_loaded}
+        if len(graph_nodes_by_id) == 0:
+            return
+        placeholders = ', '.join('?' * len(graph_nodes_by_id))
+        cursor = self.connector.execute(f'SELECT id, file, document FROM graph WHERE id IN ({placeholders});',
+                                        list(graph_nodes_by_id))
+        for graph_id, file, document in cursor:
+            graph_nodes_by_id[graph_id].set_blobs(file, document)
+
+    def __generate_attributes_to_read(self, lazy):
+        if not lazy:
+            return '*'
+        attributes = list(GRAPH_METADATA)
+        attributes.append('length(file) AS file_size')
+        attributes.append('length(CAST(document AS BLOB)) AS document_size')
+        return ', '.join(attributes)
@@ -0,0 +1,158 @@
+"""бенчмарки парсеров, обхода графа и compare_names на синтетическом наборе файлов;
+запуск из корня репозитория: python -m benchmarks.run --output benchmark.json"""
+import argparse
+import collections
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+
+import pandas as pd
+
+from benchmarks.corpus import SIZES, generate_corpus, generate_table_names
+from benchmarks.graph import SQLiteGraph
+from src.connector import GraphNode
+from src.crawler import crawl_graph, iter_crawl_results
+from src.parsers import PARSER_VERSION, find_parser, create_parser
+
+
+KEYWORDS = ['численность населения', 'заработная плата работников', 'индекс потребительских цен',
+            'инвестиции в основной капитал', 'оборот розничной торговли']
+
+
+def measure(function, repeat=1):
+    """наименьшее из repeat времен выполнения в секундах и пик памяти в байтах, выделенной интерпретатором;
+    память измеряется отдельным запуском, так как tracemalloc замедляет выполнение;
+    память, которую выделяют библиотеки на C (lxml, xlrd), tracemalloc не учитывает"""
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        seconds.append(time.perf_counter() - start)
+    tracemalloc.start()
+    function()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, min(seconds), peak_memory
+
+
+def benchmark_parsers(graph_records, repeat):
+    """пропускная способность каждого парсера по видам и размерам файлов"""
+    results = collections.defaultdict(lambda: {'files': 0, 'bytes': 0, 'tables': 0, 'seconds': 0.0, 'peak_memory': 0})
+    for graph_record in graph_records:
+        graph_node = GraphNode(graph_record)
+        parser = find_parser(graph_node)
+        result = results[(graph_record['kind'], graph_record['size'], parser.__name__)]
+        tables, elapsed, peak_memory = measure(lambda: create_parser(parser, graph_node).get_tables_info(), repeat)
+        result['files'] += 1
+        result['bytes'] += len(graph_record['file'])
+        result['tables'] += len(tables)
+        result['seconds'] += elapsed
+        result['peak_memory'] = max(result['peak_memory'], peak_memory)
+
+    report = []
+    for (kind, size, parser_name), result in results.items():
+        report.append({
+            'kind': kind,
+            'size': size,
+            'parser': parser_name,
+            **result,
+            'files_per_second': result['files'] / result['seconds'],
+            'megabytes_per_second': result['bytes'] / result['seconds'] / 2 ** 20,
+        })
+    return report
+
+
+def benchmark_crawl(graph, ids, repeat):
+    """скорость обхода: crawl_graph по одному узлу и потоковый iter_crawl_results"""
+    report = {'nodes': len(ids)}
+    for name, crawl in (('crawl_graph', lambda: [crawl_graph(graph_id, graph) for graph_id in ids]),
+                        ('iter_crawl_results', lambda: list(iter_crawl_results(ids, graph=graph)))):
+        _, elapsed, peak_memory = measure(crawl, repeat)
+        report[name] = {
+            'seconds': elapsed,
+            'nodes_per_second': len(ids) / elapsed,
+            'peak_memory': peak_memory,
+        }
+    return report
+
+
+def benchmark_compare_names(n_names_list, threshold, seed):
+    """время compare_names при разном числе названий таблиц; лемматизация каждый раз выполняется заново"""
+    from src import cos_sim
+
+    def run_compare_names():
+        cos_sim.lemmas_memo.clear()
+        return cos_sim.compare_names(parsed_names_df, KEYWORDS, threshold)
+
+    report = []
+    for n_names in n_names_list:
+        names = generate_table_names(n_names, seed)
+        parsed_names_df = pd.DataFrame({'graph_id': range(n_names), 'path': '', 'name': names})
+        df, elapsed, peak_memory = measure(run_compare_names)
+        report.append({
+            'names': n_names,
+            'keywords': len(KEYWORDS),
+            'threshold': threshold,
+            'matches': len(df),
+            'seconds': elapsed,
+            'peak_memory': peak_memory,
+        })
+    return report
+
+
+def get_git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description=__doc__)
+    argument_parser.add_argument('--output', help='файл для результатов в формате JSON (по умолчанию stdout)')
+    argument_parser.add_argument('--seed', type=int, default=0)
+    argument_parser.add_argument('--files-per-size', type=int, default=2)
+    argument_parser.add_argument('--sizes', default=','.join(SIZES),
+                                 help=f'размеры таблиц через запятую из {", ".join(SIZES)}')
+    argument_parser.add_argument('--repeat', type=int, default=3)
+    argument_parser.add_argument('--names', default='10000,100000,1000000',
+                                 help='число названий таблиц для compare_names через запятую; пустая строка — пропустить')
+    argument_parser.add_argument('--threshold', type=float, default=0.4)
+    args = argument_parser.parse_args()
+
+    sizes = {size: SIZES[size] for size in args.sizes.split(',')}
+    graph_records = generate_corpus(args.files_per_size, sizes, seed=args.seed)
+    graph = SQLiteGraph()
+    graph.insert_graph_records(graph_records)
+    ids = [graph_record['id'] for graph_record in graph_records]
+
+    report = {
+        'revision': get_git_revision(),
+        'parser_version': PARSER_VERSION,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': args.seed,
+        'corpus': {
+            'files': len(graph_records),
+            'bytes': sum(len(graph_record['file']) for graph_record in graph_records),
+            'sizes': sizes,
+        },
+        'parsers': benchmark_parsers(graph_records, args.repeat),
+        'crawl': benchmark_crawl(graph, ids, args.repeat),
+    }
+    if args.names:
+        n_names_list = [int(n_names) for n_names in args.names.split(',')]
+        report['compare_names'] = benchmark_compare_names(n_names_list, args.threshold, args.seed)
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+import json
+import sqlite3
+
+from src.config import config
+
+
+CACHE_PATH = config['cache']['CACHE_PATH']
+LEMMA_CACHE_PATH = config['cache']['LEMMA_CACHE_PATH']
+
+# поля таблицы, которые зависят только от содержимого документа
+TABLE_FIELDS = ('idx', 'name', 'n_rows', 'n_columns', 'unit', 'number')
+
+
+class ResultCache:
+    """кэш результатов парсинга в SQLite; ключ — хэш содержимого узла графа, парсер и версия парсеров"""
+
+    def __init__(self, path=CACHE_PATH):
+        self.connector = sqlite3.connect(path, timeout=60)
+        self.connector.execute('PRAGMA journal_mode=WAL;')
+        self.connector.execute('PRAGMA synchronous=NORMAL;')
+        self.connector.execute('CREATE TABLE IF NOT EXISTS results ('
+                               'hash TEXT NOT NULL, '
+                               'parser TEXT NOT NULL, '
+                               'tables TEXT, '
+                               'message TEXT, '
+                               'PRIMARY KEY (hash, parser));')
+        self.connector.commit()
+
+    def get(self, content_hash, parser):
+        """возвращает пару (таблицы, None) или (None, сообщение об ошибке парсинга);
+        None, если содержимое еще не обрабатывалось"""
+        if content_hash is None:
+            return None
+        cursor = self.connector.execute('SELECT tables, message FROM results '
+                                        'WHERE hash = ? AND parser = ?;',
+                                        (content_hash, self.__get_parser_key(parser)))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        tables, message = row
+        if tables is None:
+            return None, message
+        return [self.__load_table(table) for table in json.loads(tables)], None
+
+    def contains(self, content_hash, parser):
+        return self.get(content_hash, parser) is not None
+
+    def put(self, content_hash, parser, tables, message=None):
+        if content_hash is None:
+            return
+        if tables is not None:
+            tables = json.dumps([self.__dump_table(table) for table in tables], ensure_ascii=False)
+        self.connector.execute('INSERT OR REPLACE INTO results (hash, parser, tables, message) '
+                               'VALUES (?, ?, ?, ?);',
+                               (content_hash, self.__get_parser_key(parser), tables, message))
+        self.connector.commit()
+
+    def __get_parser_key(self, parser):
+        # парсеры импортируются при первом обращении, чтобы LemmaCache не загружал библиотеки для чтения файлов
+        from src.parsers import PARSER_VERSION
+        return f'{parser.__name__}:{PARSER_VERSION}'
+
+    def __dump_table(self, table):
+        return {field: getattr(table, field) for field in TABLE_FIELDS}
+
+    def __load_table(self, table_fields):
+        from src.parsers import TableObject
+        table = TableObject(table_fields['idx'])
+        for field in TABLE_FIELDS[1:]:
+            setattr(table, field, table_fields[field])
+        return table
+
+    def close(self):
+        self.connector.close()
+
+
+class LemmaCache:
+    """кэш лемматизированных названий таблиц в SQLite; ключ — текст после удаления пунктуации и стоп-слов"""
+
+    # ограничение SQLite на число параметров запроса
+    MAX_PARAMS = 500
+
+    def __init__(self, path=LEMMA_CACHE_PATH):
+        self.connector = sqlite3.connect(path, timeout=60)
+        self.connector.execute('PRAGMA journal_mode=WAL;')
+        self.connector.execute('PRAGMA synchronous=NORMAL;')
+        self.connector.execute('CREATE TABLE IF NOT EXISTS lemmas ('
+                               'text TEXT PRIMARY KEY, '
+                               'lemma TEXT NOT NULL);')
+        self.connector.commit()
+
+    def get_many(self, texts):
+        texts = list(texts)
+        lemmas = {}
+        for start in range(0, len(texts), self.MAX_PARAMS):
+            batch = texts[start:start + self.MAX_PARAMS]
+            placeholders = ', '.join('?' * len(batch))
+            cursor = self.connector.execute(f'SELECT text, lemma FROM lemmas WHERE text IN ({placeholders});',
+                                            batch)
+            lemmas.update(cursor.fetchall())
+        return lemmas
+
+    def put_many(self, lemmas):
+        self.connector.executemany('INSERT OR REPLACE INTO lemmas (text, lemma) VALUES (?, ?);',
+                                   lemmas.items())
+        self.connector.commit()
+
+    def close(self):
+        self.connector.close()
@@ -0,0 +1,19 @@
+import configparser
+import functools
+import os.path
+
+
+# config.ini в корне репозитория; config.ini в текущем каталоге, если есть, переопределяет его значения
+CONFIG_PATHS = (os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'config.ini'),
+                'config.ini')
+
+
+@functools.lru_cache(maxsize=None)
+def get_config(paths=CONFIG_PATHS):
+    """конфигурация читается один раз на процесс и используется всеми модулями"""
+    config = configparser.ConfigParser()
+    config.read(list(dict.fromkeys(os.path.abspath(path) for path in paths)), encoding='utf-8')
+    return config
+
+
+config = get_config()
@@ -1,91 +1,303 @@
-import configparser
 import io
+import itertools
 import os.path
 import pathlib
 import re
+import pandas as pd
 import psycopg2
 
+from src.config import config
 from src.utils import *
 
 
+BATCH_SIZE = int(config['database']['BATCH_SIZE'])
+
+# поля графа, читаемые без содержимого file и document
+GRAPH_METADATA = ('id', 'rootname', 'level', 'name', 'path', 'redirect', 'parent',
+                  'type', 'done', 'hash', 'href', 'timestamp')
+
+# выражение для полнотекстового поиска; должно совпадать в индексе и в запросах, чтобы индекс использовался
+SEARCH_VECTOR = "to_tsvector('russian', coalesce(document, ''))"
+
+# признак того, что поле узла графа еще не загружено из базы данных
+NOT_LOADED = object()
+
+
 class Graph:
     """класс, осуществляющий подключение к графу и чтение записей"""
 
+    # счетчик для уникальных имен серверных курсоров
+    __cursor_counter = itertools.count()
+
     def __init__(self):
-        config = configparser.ConfigParser()
-        config.read('config.ini')
         self.connector = psycopg2.connect(config['database']['DB_CONFIG'])
         self.cursor = self.connector.cursor()
 
-    def get_graph_record(self, graph_id):
-        query_to_read = self.__generate_query_to_read(graph_id)
-        self.cursor.execute(query_to_read)
+    def get_graph_record(self, graph_id, lazy=False):
+        """чтение записи графа; при lazy=True без содержимого полей file и document"""
+        query_to_read = self.__generate_query_to_read(lazy)
+        self.cursor.execute(query_to_read, (graph_id,))
         attribute_names = [desc[0] for desc in self.cursor.description]
         attribute_values = self.cursor.fetchone()
+        if attribute_values is None:
+            raise ValueError(f'graph.id {graph_id} не существует в таблице')
+        self.graph_id = graph_id
         graph_record = {attr: value for attr, value in zip(attribute_names, attribute_values)}
         return graph_record
 
-    def __generate_query_to_read(self, graph_id):
-        self.graph_id = self.__validate_graph_id(graph_id)
-        query_to_read = ('SELECT * '
+    def iter_graph_records(self, ids, batch_size=BATCH_SIZE, lazy=False):
+        """потоковое чтение записей графа через серверный курсор пакетами по batch_size строк;
+        возвращает пары (graph_id, graph_record) в порядке ids (для диапазона — по возрастанию id),
+        повторы id пропускаются, для отсутствующих в таблице id graph_record равен None"""
+        if isinstance(ids, range) and ids.step == 1:
+            requested_ids = ids
+            query_to_read = self.__generate_query_to_read_range(lazy)
+            params = (ids.start, ids.stop - 1)
+        else:
+            # порядок id сохраняется, например порядок плана обхода по убыванию размера (см. src.planner)
+            requested_ids = list(dict.fromkeys(ids))
+            query_to_read = self.__generate_query_to_read_many(lazy)
+            params = (requested_ids,)
+        if len(requested_ids) == 0:
+            return
+
+        cursor = self.connector.cursor(name=f'graph_records_{next(self.__cursor_counter)}')
+        cursor.itersize = batch_size
+        try:
+            cursor.execute(query_to_read, params)
+            graph_records = self.__iterate_cursor_records(cursor)
+            graph_record = next(graph_records, None)
+            for graph_id in requested_ids:
+                if graph_record is not None and graph_record['id'] == graph_id:
+                    yield graph_id, graph_record
+                    graph_record = next(graph_records, None)
+                else:
+                    yield graph_id, None
+        finally:
+            cursor.close()
+
+    def load_blobs(self, graph_nodes):
+        """загрузка полей file и document одним запросом для узлов, у которых они еще не загружены"""
+        graph_nodes_by_id = {graph_node.id: graph_node for graph_node in graph_nodes
+                             if not graph_node.blobs_loaded}
+        if len(graph_nodes_by_id) == 0:
+            return
+        query_to_read = self.__generate_query_to_read_blobs()
+        self.cursor.execute(query_to_read, (list(graph_nodes_by_id),))
+        for graph_id, file, document in self.cursor:
+            graph_nodes_by_id[graph_id].set_blobs(file, document)
+
+    def __iterate_cursor_records(self, cursor):
+        attribute_names = None
+        for attribute_values in cursor:
+            # у серверного курсора description доступен только после первой выборки
+            if attribute_names is None:
+                attribute_names = [desc[0] for desc in cursor.description]
+            yield {attr: value for attr, value in zip(attribute_names, attribute_values)}
+
+    def __generate_attributes_to_read(self, lazy):
+        if not lazy:
+            return 'public.graph.*'
+        # вместо содержимого file и document читаем только их размер
+        attributes = [f'public.graph.{attr}' for attr in GRAPH_METADATA]
+        attributes.append('octet_length(public.graph.file) AS file_size')
+        attributes.append('octet_length(public.graph.document) AS document_size')
+        return ', '.join(attributes)
+
+    def __generate_query_to_read(self, lazy):
+        query_to_read = (f'SELECT {self.__generate_attributes_to_read(lazy)} '
                          'FROM public.graph '
-                         f'WHERE public.graph.id = {self.graph_id};')
+                         'WHERE public.graph.id = %s;')
         return query_to_read
 
-    def search(self, text):
-        query_to_search = self.__generate_query_to_search(text)
-        self.cursor.execute(query_to_search)
-        
+    def __generate_query_to_read_range(self, lazy):
+        query_to_read = (f'SELECT {self.__generate_attributes_to_read(lazy)} '
+                         'FROM public.graph '
+                         'WHERE public.graph.id BETWEEN %s AND %s '
+                         'ORDER BY public.graph.id;')
+        return query_to_read
+
+    def __generate_query_to_read_many(self, lazy):
+        # WITH ORDINALITY сохраняет порядок переданного массива id; array_position был бы квадратичным
+        query_to_read = (f'SELECT {self.__generate_attributes_to_read(lazy)} '
+                         'FROM unnest(%s::bigint[]) WITH ORDINALITY AS requested(id, ordinal) '
+                         'JOIN public.graph ON public.graph.id = requested.id '
+                         'ORDER BY requested.ordinal;')
+        return query_to_read
+
+    def __generate_query_to_read_blobs(self):
+        query_to_read = ('SELECT public.graph.id, public.graph.file, public.graph.document '
+                         'FROM public.graph '
+                         'WHERE public.graph.id = ANY(%s);')
+        return query_to_read
+
+    def create_search_index(self, method='fts'):
+        """создание индекса по полю document для ускорения search:
+        'fts' — GIN-индекс по tsvector с русской морфологией, 'substring' — триграммный GIN-индекс (pg_trgm)"""
+        self.__validate_search_method(method)
+        if method == 'fts':
+            self.cursor.execute('CREATE INDEX IF NOT EXISTS graph_document_fts_idx '
+                                f'ON public.graph USING GIN ({SEARCH_VECTOR});')
+        else:
+            self.cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm;')
+            self.cursor.execute('CREATE INDEX IF NOT EXISTS graph_document_trgm_idx '
+                                'ON public.graph USING GIN (document gin_trgm_ops);')
+        self.connector.commit()
+
+    def search(self, text, method='substring', limit=None, offset=0):
+        """поиск узлов графа по содержимому поля document:
+        'substring' — точное вхождение строки, 'fts' — полнотекстовый поиск с учетом морфологии,
+        поддерживающий несколько слов, фразы в кавычках, OR и исключение слов через минус;
+        результаты 'fts' упорядочены по убыванию релевантности rank"""
+        query_to_search = self.__generate_query_to_search(method)
+        self.cursor.execute(query_to_search, (self.__get_search_pattern(text, method), limit, offset))
+        return self.__collect_search_results()
+
+    def iter_search(self, text, method='substring', limit=None, offset=0, batch_size=BATCH_SIZE):
+        """поиск с потоковой выдачей результатов через серверный курсор:
+        узлы графа возвращаются по мере получения, пакетами по batch_size строк"""
+        query_to_search = self.__generate_query_to_search(method)
+        cursor = self.connector.cursor(name=f'graph_search_{next(self.__cursor_counter)}')
+        cursor.itersize = batch_size
+        try:
+            cursor.execute(query_to_search, (self.__get_search_pattern(text, method), limit, offset))
+            yield from self.__iterate_cursor_records(cursor)
+        finally:
+            cursor.close()
+
+    def search_dataframe(self, text, method='substring', limit=None, offset=0):
+        """поиск с результатом в виде датафрейма, собираемого из строк выборки целиком"""
+        query_to_search = self.__generate_query_to_search(method)
+        self.cursor.execute(query_to_search, (self.__get_search_pattern(text, method), limit, offset))
         graph_attribute_names = [desc[0] for desc in self.cursor.description]
-        graph_attribute_values = self.cursor.fetchone()
-        graph_node_with_text = {attr: [] for attr in graph_attribute_names}
-        while graph_attribute_values:
-            for attr, value in zip(graph_attribute_names, graph_attribute_values):
-                graph_node_with_text[attr].append(value)
-            graph_attribute_values = self.cursor.fetchone()
+        return pd.DataFrame.from_records(self.cursor.fetchall(), columns=graph_attribute_names)
 
+    def search_many(self, texts, method='substring', limit=None):
+        """поиск нескольких строк одним запросом; в результат добавляется поле text с искомой строкой,
+        limit ограничивает число результатов для каждой строки"""
+        query_to_search = self.__generate_query_to_search_many(method)
+        patterns = [self.__get_search_pattern(text, method) for text in texts]
+        self.cursor.execute(query_to_search, (list(texts), patterns, limit))
+        return self.__collect_search_results()
+
+    def __collect_search_results(self):
+        graph_attribute_names = [desc[0] for desc in self.cursor.description]
+        graph_attribute_values = self.cursor.fetchall()
+        # транспонируем строки выборки в столбцы
+        columns = zip(*graph_attribute_values) if graph_attribute_values else [()] * len(graph_attribute_names)
+        graph_node_with_text = {attr: list(values) for attr, values in zip(graph_attribute_names, columns)}
         return graph_node_with_text
 
-    def __generate_query_to_search(self, text):
-        query_to_search = ('SELECT public.graph.id, public.graph.path '
-                           'FROM public.graph '
-                           f"WHERE public.graph.document LIKE '%{text}%';")
+    def __get_search_pattern(self, text, method):
+        self.__validate_search_method(method)
+        if method == 'fts':
+            return text
+        # экранируем спецсимволы LIKE, чтобы искать строку буквально
+        text = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        return f'%{text}%'
+
+    def __validate_search_method(self, method):
+        if method not in ('substring', 'fts'):
+            raise ValueError(f'неизвестный метод поиска {method}')
+
+    def __generate_query_to_search(self, method):
+        if method == 'fts':
+            query_to_search = ('SELECT public.graph.id, public.graph.path, '
+                               f'ts_rank({SEARCH_VECTOR}, query) AS rank '
+                               "FROM public.graph, websearch_to_tsquery('russian', %s) AS query "
+                               f'WHERE {SEARCH_VECTOR} @@ query '
+                               'ORDER BY rank DESC, public.graph.id '
+                               'LIMIT %s OFFSET %s;')
+        else:
+            query_to_search = ('SELECT public.graph.id, public.graph.path '
+                               'FROM public.graph '
+                               'WHERE public.graph.document LIKE %s '
+                               'ORDER BY public.graph.id '
+                               'LIMIT %s OFFSET %s;')
         return query_to_search
 
-    def __validate_graph_id(self, graph_id):
-        query_to_check = ('SELECT public.graph.id '
-                          'FROM public.graph '
-                          f'WHERE public.graph.id = {graph_id};')
-        self.cursor.execute(query_to_check)
-        if self.cursor.fetchone():
-            return graph_id
+    def __generate_query_to_search_many(self, method):
+        self.__validate_search_method(method)
+        if method == 'fts':
+            query_to_search = ('SELECT search.text, found.id, found.path, found.rank '
+                               'FROM unnest(%s::text[], %s::text[]) AS search(text, pattern) '
+                               'CROSS JOIN LATERAL ('
+                               'SELECT public.graph.id, public.graph.path, '
+                               f'ts_rank({SEARCH_VECTOR}, query) AS rank '
+                               "FROM public.graph, websearch_to_tsquery('russian', search.pattern) AS query "
+                               f'WHERE {SEARCH_VECTOR} @@ query '
+                               'ORDER BY rank DESC, public.graph.id '
+                               'LIMIT %s) AS found;')
         else:
-            raise ValueError(f'graph.id {graph_id} не существует в таблице')
+            query_to_search = ('SELECT search.text, found.id, found.path '
+                               'FROM unnest(%s::text[], %s::text[]) AS search(text, pattern) '
+                               'CROSS JOIN LATERAL ('
+                               'SELECT public.graph.id, public.graph.path '
+                               'FROM public.graph '
+                               'WHERE public.graph.document LIKE search.pattern '
+                               'ORDER BY public.graph.id '
+                               'LIMIT %s) AS found;')
+        return query_to_search
 
     def __del__(self):
         self.connector.close()
 
 
 class GraphNode:
-    """класс с информацией об узле графа"""
-
-    def __init__(self, graph_record):
-        self.id = graph_record['id']
-        self.rootname = graph_record['rootname']
-        self.level = graph_record['level']
-        self.name = graph_record['name']
-        self.path = graph_record['path']
-        self.redirect = graph_record['redirect']
-        self.parent = graph_record['parent']
-        self.document = graph_record['document']
-        self.file = graph_record['file']
-        self.type = graph_record['type']
-        self.done = graph_record['done']
-        self.hash = graph_record['hash']
-        self.href = graph_record['href']
-        self.timestamp = graph_record['timestamp']
+    """класс с информацией об узле графа;
+    если запись прочитана без полей file и document, они загружаются при первом обращении"""
+
+    __slots__ = (GRAPH_METADATA + ('file_size', 'document_size', 'file_ext')
+                 + ('_file', '_document', '_graph'))
+
+    def __init__(self, graph_record, graph=None):
+        for attr in GRAPH_METADATA:
+            setattr(self, attr, graph_record[attr])
+        self._file = graph_record.get('file', NOT_LOADED)
+        self._document = graph_record.get('document', NOT_LOADED)
+        self._graph = graph
+        self.file_size = graph_record.get('file_size')
+        self.document_size = graph_record.get('document_size')
+        if self.blobs_loaded:
+            self.__set_blobs_size()
         self.file_ext = self.__get_file_ext(self.path)
 
+    @property
+    def file(self):
+        if self._file is NOT_LOADED:
+            self.load_blobs()
+        return self._file
+
+    @property
+    def document(self):
+        if self._document is NOT_LOADED:
+            self.load_blobs()
+        return self._document
+
+    @property
+    def blobs_loaded(self):
+        return self._file is not NOT_LOADED and self._document is not NOT_LOADED
+
+    def load_blobs(self):
+        if self._graph is None:
+            raise ValueError(f'содержимое узла графа {self.id} не загружено (нет подключения к графу)')
+        self._graph.load_blobs([self])
+        if not self.blobs_loaded:
+            raise ValueError(f'graph.id {self.id} не существует в таблице')
+
+    def set_blobs(self, file, document):
+        self._file = file
+        self._document = document
+        self.__set_blobs_size()
+
+    def __set_blobs_size(self):
+        # размеры, прочитанные через octet_length в запросе метаданных, не пересчитываются
+        if self.file_size is None and self._file is not None:
+            self.file_size = len(self._file)
+        if self.document_size is None and self._document is not None:
+            # размер document в байтах UTF-8, как octet_length
+            self.document_size = len(self._document.encode('utf-8'))
+
     def save_file(self, path=None):
         content = io.BytesIO(self.file)
         file_name = str(self.id)
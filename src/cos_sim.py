@@ -1,64 +1,133 @@
-import configparser
+import functools
+import os.path
 import string
+import sys
 import pandas as pd
 import numpy as np
 
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction.text import CountVectorizer
+from src.config import config
+from src.utils import chunked
 
-from nltk.corpus import stopwords
-from pymystem3 import Mystem
 
-import nltk
-nltk.download('stopwords')
-
-
-config = configparser.ConfigParser()
-config.read('config.ini')
 SHORT_WORD = int(config['tables']['SHORT_WORD'])
 EXTRA_STOPWORDS = config['tables']['EXTRA_STOPWORDS'].split(',')
 
-stopwords_list = stopwords.words('russian') + EXTRA_STOPWORDS
+# русские стоп-слова nltk, сохраненные в репозитории, чтобы не скачивать их при импорте
+STOPWORDS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stopwords_ru.txt')
+with open(STOPWORDS_PATH, encoding='utf-8') as f:
+    stopwords_list = f.read().split() + EXTRA_STOPWORDS
+stopwords_set = set(stopwords_list)
+
+
+# предложения передаются в mystem пакетами в одной строке через разделитель,
+# которого не может быть в тексте после удаления пунктуации
+LEMMATIZE_BATCH = 1000
+LEMMATIZE_SEPARATOR = ' | '
+
+
+@functools.lru_cache(maxsize=None)
+def get_mystem():
+    """процесс mystem запускается при первой лемматизации, а не при импорте модуля"""
+    from pymystem3 import Mystem
+    return Mystem()
 
-m = Mystem()
+
+# лемматизированные предложения, уже обработанные в текущем процессе
+lemmas_memo = {}
 
 
 def preprocess(sentence):
-    sentence = sentence.lower()
-    sentence = ''.join([symbol for symbol in sentence if symbol not in string.punctuation and not symbol.isdigit()])
-    sentence = ' '.join([word for word in sentence.split() if word not in stopwords_list and len(word) > SHORT_WORD])
-    sentence = ''.join(m.lemmatize(sentence)).strip()
+    return preprocess_many([sentence])[0]
+
+
+def preprocess_many(sentences, cache=None):
+    """предобработка и лемматизация списка предложений; mystem вызывается один раз на пакет
+    из LEMMATIZE_BATCH предложений, результаты сохраняются в памяти и в кэше LemmaCache, если он передан"""
+    normalized_sentences = [normalize(sentence) for sentence in sentences]
+    
+    missing = {sentence for sentence in normalized_sentences if sentence not in lemmas_memo}
+    if cache is not None and missing:
+        lemmas_memo.update(cache.get_many(missing))
+        missing = [sentence for sentence in missing if sentence not in lemmas_memo]
+    
+    for batch in chunked(sorted(missing), LEMMATIZE_BATCH):
+        lemmas = dict(zip(batch, lemmatize_many(batch)))
+        lemmas_memo.update(lemmas)
+        if cache is not None:
+            cache.put_many(lemmas)
+    
+    return [lemmas_memo[sentence] for sentence in normalized_sentences]
+
+
+@functools.lru_cache(maxsize=None)
+def get_removal_table():
+    """таблица для удаления знаков пунктуации и цифр (в том числе не ASCII) за один вызов str.translate"""
+    removed_symbols = string.punctuation + ''.join(chr(i) for i in range(sys.maxunicode + 1) if chr(i).isdigit())
+    return str.maketrans('', '', removed_symbols)
+
+
+def normalize(sentence):
+    sentence = sentence.lower().translate(get_removal_table())
+    sentence = ' '.join([word for word in sentence.split() if word not in stopwords_set and len(word) > SHORT_WORD])
     return sentence
 
 
-def compare_names(parsed_names_df, keywords, threshold):
+def lemmatize_many(sentences):
+    mystem = get_mystem()
+    lemmatized = ''.join(mystem.lemmatize(LEMMATIZE_SEPARATOR.join(sentences))).split(LEMMATIZE_SEPARATOR.strip())
+    if len(lemmatized) != len(sentences):
+        # разделитель не сохранился в выводе mystem, лемматизируем предложения по одному
+        lemmatized = [''.join(mystem.lemmatize(sentence)) for sentence in sentences]
+    return [sentence.strip() for sentence in lemmatized]
+
+
+def compare_names(parsed_names_df, keywords, threshold, cache=None, top_k=None):
+    """косинусное расстояние между ключевыми предложениями и названиями таблиц;
+    считается только разреженная матрица названия × ключевые слова, в результат входят пары с cos_sim >= threshold,
+    при заданном top_k — не более top_k наиболее близких названий для каждого ключевого предложения"""
+    from sklearn.feature_extraction.text import CountVectorizer
+    from sklearn.preprocessing import normalize as l2_normalize
+
     parsed_names = list(parsed_names_df['name'])
     sentences = keywords + parsed_names
-    preprocessed_sentences = list(map(preprocess, sentences))
-    vectorizer = CountVectorizer().fit_transform(preprocessed_sentences)
-    vectors = vectorizer.toarray()
-    cos_sim = cosine_similarity(vectors)
+    preprocessed_sentences = preprocess_many(sentences, cache)
+    vectors = CountVectorizer().fit_transform(preprocessed_sentences)
+    vectors = l2_normalize(vectors.astype(np.float64))
     
     keywords_num = len(keywords)
-    indices = [
-        list(parsed_names_df['graph_id']),
-        list(parsed_names_df['path']),
-        list(parsed_names_df['name']),
-    ]
+    cos_sim = vectors[keywords_num:] @ vectors[:keywords_num].T
+    
+    return build_cos_sim_df(cos_sim, parsed_names_df, keywords, threshold, top_k)
+
+
+def build_cos_sim_df(cos_sim, parsed_names_df, keywords, threshold, top_k=None):
+    """датафрейм в формате compare_names из разреженной матрицы cos_sim размера названия × ключевые слова"""
+    if threshold > 0:
+        # нулевые значения не могут пройти порог, достаточно ненулевых элементов матрицы
+        cos_sim = cos_sim.tocoo()
+        mask = cos_sim.data >= threshold
+        rows, columns, values = cos_sim.row[mask], cos_sim.col[mask], cos_sim.data[mask]
+    else:
+        dense_cos_sim = cos_sim.toarray()
+        rows, columns = np.nonzero(dense_cos_sim >= threshold)
+        values = dense_cos_sim[rows, columns]
     
-    cos_sim_df = pd.DataFrame(data=cos_sim[keywords_num:, :keywords_num],
-                              columns=keywords,
-                              index=indices)
-    cos_sim_df = cos_sim_df.reset_index()
-    cos_sim_df = cos_sim_df.rename(columns={'level_0': 'graph_id',
-                                            'level_1': 'path',
-                                            'level_2': 'table_name'})
+    if top_k is not None:
+        # сортируем по ключевому слову и убыванию cos_sim, оставляем первые top_k в каждой группе
+        order = np.lexsort((-values, columns))
+        rows, columns, values = rows[order], columns[order], values[order]
+        group_starts = np.searchsorted(columns, columns, side='left')
+        mask = np.arange(len(columns)) - group_starts < top_k
+        rows, columns, values = rows[mask], columns[mask], values[mask]
     
-    linear_df = cos_sim_df.melt(id_vars=['graph_id', 'path', 'table_name'],
-                        var_name='keyword',
-                        value_name='cos_sim')
-    linear_df = linear_df[linear_df['cos_sim'] >= threshold]
+    linear_df = pd.DataFrame(data={
+        'graph_id': parsed_names_df['graph_id'].to_numpy()[rows],
+        'path': parsed_names_df['path'].to_numpy()[rows],
+        'table_name': parsed_names_df['name'].to_numpy()[rows],
+        'keyword': np.asarray(keywords, dtype=object)[columns],
+        'cos_sim': values,
+    })
     linear_df = linear_df.sort_values(by=['keyword', 'cos_sim'])
     linear_df.reset_index(drop=True, inplace=True)
     
-    return linear_df
\ No newline at end of file
+    return linear_df
@@ -1,41 +1,233 @@
+import functools
+import multiprocessing
 import sys
 import pandas as pd
 import numpy as np
-from src.connector import Graph, GraphNode
+from src.cache import ResultCache
+from src.config import config
+from src.connector import Graph, GraphNode, BATCH_SIZE
+from src.metrics import CrawlMetrics, NodeListExporter, timer
 from src.parsers import *
 from src.cos_sim import *
 
 
-def crawl_graph(graph_id):
+CHUNK_SIZE = int(config['crawler']['CHUNK_SIZE'])
+
+# подключение к графу и кэш результатов в процессе-обработчике crawl_graphs
+worker_graph = None
+worker_cache = None
+
+
+def crawl_graph(graph_id, graph=None, cache=None, metrics=None):
+    """при заданном metrics (см. src.metrics) измеряется время этапов обработки узла"""
+    if graph is None:
+        graph = Graph()
+    if metrics is not None:
+        metrics.start_node(graph_id)
+    with timer(metrics, 'fetch'):
+        try:
+            graph_node = GraphNode(graph.get_graph_record(graph_id, lazy=True), graph)
+        except ValueError:
+            graph_node = None
+    if metrics is not None and graph_node is not None:
+        metrics.set_graph_node(graph_node)
+    tables, failure = extract_tables(graph_id, graph_node, cache, metrics)
+    with timer(metrics, 'build'):
+        df = build_dataframe(tables, failure)
+    if metrics is not None:
+        metrics.finish_node(tables, failure)
+    return df
+
+
+def iter_crawl_graph(ids, batch_size=BATCH_SIZE, graph=None, cache=None, metrics=None):
+    """обход узлов графа по одному подключению с потоковым чтением записей;
+    для каждого id в порядке ids (для диапазона — по возрастанию id) возвращает датафрейм в формате crawl_graph"""
+    for tables, failure in iter_crawl_results(ids, batch_size, graph, cache, metrics):
+        with timer(metrics, 'build'):
+            df = build_dataframe(tables, failure)
+        yield df
+
+
+def crawl_graphs(ids, workers=None, chunk_size=CHUNK_SIZE, batch_size=BATCH_SIZE, cache_path=None, metrics=None):
+    """параллельный обход узлов графа в workers процессах (по умолчанию по числу ядер);
+    каждый процесс держит одно подключение к графу и обрабатывает id порциями по chunk_size;
+    возвращает датафреймы в том же формате, что и iter_crawl_graph, порция за порцией: внутри порции в порядке ids
+    (для диапазона — по возрастанию id), список id делится на порции чередованием (см. split_ids)"""
+    for tables, failure in iter_crawl_results_parallel(ids, workers, chunk_size, batch_size, cache_path, metrics):
+        with timer(metrics, 'build'):
+            df = build_dataframe(tables, failure)
+        yield df
+
+
+def crawl_to_sink(ids, sink, workers=1, chunk_size=CHUNK_SIZE, batch_size=BATCH_SIZE, cache_path=None,
+                  metrics=None):
+    """обход узлов графа с записью результатов в приемник sink (см. src.sink) без построения
+    датафрейма для каждого узла; узлы, результаты которых уже есть в приемнике, пропускаются"""
+    processed_ids = sink.processed_ids()
+    if processed_ids:
+        ids = [graph_id for graph_id in ids if graph_id not in processed_ids]
+    if workers == 1:
+        cache = ResultCache(cache_path) if cache_path is not None else None
+        results = iter_crawl_results(ids, batch_size, cache=cache, metrics=metrics)
+    else:
+        results = iter_crawl_results_parallel(ids, workers, chunk_size, batch_size, cache_path, metrics)
+    for tables, failure in results:
+        with timer(metrics, 'write'):
+            sink.write(tables, failure)
+    with timer(metrics, 'write'):
+        sink.flush()
+
+
+def iter_crawl_results_parallel(ids, workers=None, chunk_size=CHUNK_SIZE, batch_size=BATCH_SIZE, cache_path=None,
+                                metrics=None):
+    crawl_chunk = functools.partial(crawl_graph_chunk, batch_size=batch_size, collect_metrics=metrics is not None)
+    with multiprocessing.Pool(workers, initializer=init_crawl_worker, initargs=(cache_path,)) as pool:
+        for results, nodes, stage_seconds in pool.imap(crawl_chunk, split_ids(ids, chunk_size)):
+            if metrics is not None:
+                metrics.merge(nodes, stage_seconds)
+            yield from results
+
+
+def init_crawl_worker(cache_path=None):
+    global worker_graph, worker_cache
+    worker_graph = Graph()
+    if cache_path is not None:
+        worker_cache = ResultCache(cache_path)
+
+
+def crawl_graph_chunk(ids, batch_size=BATCH_SIZE, collect_metrics=False):
+    """результаты обхода порции id и, при collect_metrics, измерения узлов и суммарное время этапов"""
+    if not collect_metrics:
+        return list(iter_crawl_results(ids, batch_size, worker_graph, worker_cache)), [], {}
+    exporter = NodeListExporter()
+    metrics = CrawlMetrics(exporters=[exporter])
+    results = list(iter_crawl_results(ids, batch_size, worker_graph, worker_cache, metrics))
+    return results, exporter.nodes, dict(metrics.stage_seconds)
+
+
+def iter_crawl_results(ids, batch_size=BATCH_SIZE, graph=None, cache=None, metrics=None):
+    if graph is None:
+        graph = Graph()
+    graph_records = graph.iter_graph_records(ids, batch_size=batch_size, lazy=True)
+    batches = chunked(graph_records, batch_size)
+    while True:
+        # записи читаются пакетами, поэтому время чтения учитывается только в суммарном времени этапов
+        with timer(metrics, 'fetch'):
+            batch = next(batches, None)
+        if batch is None:
+            break
+        graph_nodes = [(graph_id, GraphNode(graph_record, graph) if graph_record else None)
+                       for graph_id, graph_record in batch]
+        # содержимое file и document загружаем одним запросом и только для узлов,
+        # у которых есть парсер и результат которых еще не сохранен в кэше
+        with timer(metrics, 'load_blobs'):
+            graph.load_blobs([graph_node for _, graph_node in graph_nodes
+                              if graph_node is not None and needs_parsing(graph_node, cache)])
+        for graph_id, graph_node in graph_nodes:
+            if metrics is not None:
+                metrics.start_node(graph_id, graph_node)
+            tables, failure = extract_tables(graph_id, graph_node, cache, metrics)
+            if metrics is not None:
+                metrics.finish_node(tables, failure)
+            yield tables, failure
+
+
+def needs_parsing(graph_node, cache=None):
+    try:
+        parser = find_parser(graph_node)
+    except UnknownContentType:
+        return True
+    except TypeError:
+        return False
+    return cache is None or not cache.contains(graph_node.hash, parser)
+
+
+def parse_graph_node(graph_node, cache=None, metrics=None):
+    """таблицы в содержимом узла графа; при наличии кэша одинаковое содержимое парсится один раз"""
+    with timer(metrics, 'find_parser'):
+        try:
+            parser = find_parser(graph_node)
+        except UnknownContentType:
+            parser = None
+    if parser is not None:
+        cached_tables = get_cached_tables(graph_node, parser, cache, metrics)
+        if cached_tables is not None:
+            return cached_tables
+    # содержимое узла загружаем до парсинга, чтобы ошибки чтения из базы данных не попали в кэш
+    if not graph_node.blobs_loaded:
+        with timer(metrics, 'load_blobs'):
+            graph_node.load_blobs()
+        # по загруженному содержимому парсер определяется точнее, чем по MIME-типу и расширению
+        metadata_parser = parser
+        with timer(metrics, 'find_parser'):
+            parser = find_parser(graph_node)
+        if parser is not metadata_parser:
+            cached_tables = get_cached_tables(graph_node, parser, cache, metrics)
+            if cached_tables is not None:
+                return cached_tables
     try:
-        graph_record = Graph().get_graph_record(graph_id)
-        graph_node = GraphNode(graph_record)
+        with timer(metrics, 'parse'):
+            tables = create_parser(parser, graph_node).get_tables_info()
+    except ValueError:
+        if cache is not None:
+            cache.put(graph_node.hash, parser, None, str(sys.exc_info()[1]))
+        raise
+    if cache is not None:
+        with timer(metrics, 'cache'):
+            cache.put(graph_node.hash, parser, tables)
+    return tables
+
+
+def get_cached_tables(graph_node, parser, cache=None, metrics=None):
+    """таблицы из кэша результатов или None; для сохраненной ошибки парсинга вызывает ValueError"""
+    if metrics is not None:
+        metrics.update_node(parser=parser.__name__)
+    if cache is None:
+        return None
+    with timer(metrics, 'cache'):
+        cached_result = cache.get(graph_node.hash, parser)
+    if cached_result is None:
+        return None
+    if metrics is not None:
+        metrics.update_node(cache_hit=True)
+    tables, message = cached_result
+    if tables is None:
+        raise ValueError(message)
+    return tables
+
+
+def extract_tables(graph_id, graph_node, cache=None, metrics=None):
+    """возвращает пару (таблицы, None), если таблицы найдены, иначе (None, описание ошибки)"""
+    path = None
+    try:
+        if graph_node is None:
+            raise ValueError(f'graph.id {graph_id} не существует в таблице')
         path = graph_node.path
         if graph_id == 55072:
             raise ValueError('обрабатывать вручную')
-        parser = choose_parser(graph_node)
-        tables = parser.get_tables_info()
+        tables = parse_graph_node(graph_node, cache, metrics)
 
         if len(tables) != 0:
             for table in tables:
                 table.graph_id = graph_id
                 table.path = path
-            df_success = pd.DataFrame(data=[table.__dict__ for table in tables])
-            df_success = df_success.replace(r'^\s*$', np.nan, regex=True)
-            df_success = df_success.dropna(subset=['name'])
-            df_success._name = 'df_success'
-            return df_success
+            return tables, None
         else:
             message = 'таблицы в файле не найдены'
-            df_failure = pd.DataFrame(data={'graph_id': [graph_id],
-                                            'path': [path],
-                                            'message': [message]})
-            df_failure._name = 'df_failure'
-            return df_failure
     except (ValueError, TypeError):
         message = str(sys.exc_info()[1])
-        df_failure = pd.DataFrame(data={'graph_id': [graph_id],
-                                        'path': [path],
-                                        'message': [message]})
+    failure = {'graph_id': graph_id, 'path': path, 'message': message}
+    return None, failure
+
+
+def build_dataframe(tables, failure):
+    if tables:
+        df_success = pd.DataFrame(data=[table.to_dict() for table in tables])
+        df_success = df_success.replace(r'^\s*$', np.nan, regex=True)
+        df_success = df_success.dropna(subset=['name'])
+        df_success._name = 'df_success'
+        return df_success
+    else:
+        df_failure = pd.DataFrame(data={attr: [value] for attr, value in failure.items()})
         df_failure._name = 'df_failure'
         return df_failure
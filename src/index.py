@@ -0,0 +1,115 @@
+import collections
+import json
+import os.path
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from src.cos_sim import preprocess_many, build_cos_sim_df
+
+
+class TableNameIndex:
+    """индекс названий таблиц для поиска по ключевым словам: словарь лемм и L2-нормированная
+    разреженная матрица названий; строится один раз по результатам обхода графа и дополняется новыми"""
+
+    MATRIX_FILE = 'matrix.npz'
+    VOCABULARY_FILE = 'vocabulary.json'
+    TABLES_FILE = 'tables.csv'
+    # типы столбцов таблиц одинаковы у построенного и загруженного с диска индекса
+    TABLES_DTYPES = {'graph_id': 'int64', 'path': 'object', 'name': 'object'}
+
+    def __init__(self):
+        from sklearn.feature_extraction.text import CountVectorizer
+
+        self.vocabulary = {}
+        self.matrix = sparse.csr_matrix((0, 0), dtype=np.float64)
+        self.tables = pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in self.TABLES_DTYPES.items()})
+        self.__postings = None
+        # токенизация совпадает с CountVectorizer в compare_names
+        self.analyzer = CountVectorizer().build_analyzer()
+
+    @property
+    def postings(self):
+        """инвертированный индекс: столбец матрицы в формате CSC для леммы — номера содержащих ее таблиц"""
+        if self.__postings is None:
+            self.__postings = self.matrix.tocsc()
+        return self.__postings
+
+    @classmethod
+    def build(cls, parsed_names_df, cache=None):
+        index = cls()
+        index.append(parsed_names_df, cache)
+        return index
+
+    def append(self, parsed_names_df, cache=None):
+        """добавление названий таблиц; ранее добавленные таблицы тех же узлов графа заменяются новыми"""
+        tables = parsed_names_df[list(self.TABLES_DTYPES)].astype(self.TABLES_DTYPES).reset_index(drop=True)
+        preprocessed_names = preprocess_many(list(tables['name']), cache)
+        vectors = self.__vectorize(preprocessed_names, extend_vocabulary=True)
+
+        keep = ~self.tables['graph_id'].isin(tables['graph_id']).to_numpy()
+        matrix = self.matrix[np.flatnonzero(keep)] if not keep.all() else self.matrix
+        # в старой матрице нет столбцов для новых лемм
+        matrix = sparse.csr_matrix(matrix, shape=(matrix.shape[0], len(self.vocabulary)))
+        self.matrix = sparse.vstack([matrix, vectors], format='csr')
+        self.tables = pd.concat([self.tables[keep], tables], ignore_index=True)
+        self.__postings = None
+
+    def query(self, keywords, threshold, top_k=None, cache=None):
+        """датафрейм в формате compare_names для ключевых предложений keywords;
+        все ключевые предложения обрабатываются одним матричным умножением"""
+        preprocessed_keywords = preprocess_many(keywords, cache)
+        vectors = self.__vectorize(preprocessed_keywords, extend_vocabulary=False)
+        if threshold > 0:
+            # ненулевой cos_sim возможен только у названий, имеющих общую лемму с ключевым предложением,
+            # поэтому умножаем только столбцы инвертированного индекса для лемм из ключевых предложений
+            terms = np.unique(vectors.indices)
+            cos_sim = self.postings[:, terms] @ vectors[:, terms].T
+        else:
+            cos_sim = self.matrix @ vectors.T
+        return build_cos_sim_df(cos_sim, self.tables, keywords, threshold, top_k)
+
+    def __vectorize(self, sentences, extend_vocabulary):
+        """L2-нормированные векторы предложений в пространстве словаря индекса;
+        норма считается по всем леммам предложения, в том числе отсутствующим в словаре,
+        чтобы значения cos_sim совпадали с compare_names"""
+        indptr = [0]
+        indices = []
+        data = []
+        norms = []
+        for sentence in sentences:
+            term_counts = collections.Counter(self.analyzer(sentence))
+            norms.append(np.sqrt(sum(count ** 2 for count in term_counts.values())))
+            for term, count in term_counts.items():
+                if term not in self.vocabulary:
+                    if not extend_vocabulary:
+                        continue
+                    self.vocabulary[term] = len(self.vocabulary)
+                indices.append(self.vocabulary[term])
+                data.append(count)
+            indptr.append(len(indices))
+
+        vectors = sparse.csr_matrix((np.asarray(data, dtype=np.float64), indices, indptr),
+                                    shape=(len(sentences), len(self.vocabulary)))
+        norms = np.asarray(norms, dtype=np.float64)
+        norms[norms == 0] = 1
+        vectors = sparse.diags(1 / norms) @ vectors
+        return vectors.tocsr()
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        sparse.save_npz(os.path.join(directory, self.MATRIX_FILE), self.matrix)
+        with open(os.path.join(directory, self.VOCABULARY_FILE), 'w', encoding='utf-8') as f:
+            json.dump(self.vocabulary, f, ensure_ascii=False)
+        self.tables.to_csv(os.path.join(directory, self.TABLES_FILE), index=False)
+
+    @classmethod
+    def load(cls, directory):
+        index = cls()
+        index.matrix = sparse.load_npz(os.path.join(directory, cls.MATRIX_FILE)).tocsr()
+        with open(os.path.join(directory, cls.VOCABULARY_FILE), encoding='utf-8') as f:
+            index.vocabulary = json.load(f)
+        index.tables = pd.read_csv(os.path.join(directory, cls.TABLES_FILE), keep_default_na=False,
+                                   dtype={'path': str, 'name': str}).astype(cls.TABLES_DTYPES)
+        return index
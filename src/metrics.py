@@ -0,0 +1,246 @@
+import bisect
+import collections
+import contextlib
+import heapq
+import json
+import os
+import time
+
+import numpy as np
+
+
+# границы интервалов гистограммы времени обработки узла в секундах
+HISTOGRAM_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300)
+PERCENTILES = (50, 90, 99)
+TOP_N = 20
+
+
+class NodeMetrics:
+    """измерения для одного узла графа: время этапов обработки, размер содержимого, парсер и результат"""
+
+    __slots__ = ('graph_id', 'type', 'path', 'file_size', 'document_size', 'parser', 'cache_hit',
+                 'outcome', 'message', 'n_tables', 'stages', 'seconds', 'start')
+
+    def __init__(self, graph_id):
+        self.graph_id = graph_id
+        self.type = None
+        self.path = None
+        self.file_size = None
+        self.document_size = None
+        self.parser = None
+        self.cache_hit = False
+        self.outcome = None
+        self.message = None
+        self.n_tables = 0
+        self.stages = {}
+        self.seconds = None
+        self.start = time.perf_counter()
+
+    def to_dict(self):
+        return {attr: getattr(self, attr) for attr in self.__slots__ if attr != 'start'}
+
+
+class CrawlMetrics:
+    """сбор измерений при обходе графа: время этапов для каждого узла, гистограммы и перцентили
+    времени по типам узлов, top_n самых медленных узлов; exporters получают каждый узел и итоговую сводку"""
+
+    def __init__(self, exporters=(), top_n=TOP_N, buckets=HISTOGRAM_BUCKETS):
+        self.exporters = list(exporters)
+        self.top_n = top_n
+        self.buckets = buckets
+        self.node = None
+        self.n_nodes = 0
+        self.outcomes = collections.Counter()
+        # суммарное время этапов, в том числе этапов, выполняемых для пакета узлов
+        self.stage_seconds = collections.Counter()
+        self.seconds_by_type = collections.defaultdict(list)
+        self.slowest_heap = []
+
+    def start_node(self, graph_id, graph_node=None):
+        self.node = NodeMetrics(graph_id)
+        if graph_node is not None:
+            self.set_graph_node(graph_node)
+        return self.node
+
+    def set_graph_node(self, graph_node):
+        if self.node is None:
+            return
+        self.node.type = graph_node.type
+        self.node.path = graph_node.path
+        self.node.file_size = graph_node.file_size
+        self.node.document_size = graph_node.document_size
+
+    def update_node(self, **fields):
+        if self.node is None:
+            return
+        for attr, value in fields.items():
+            setattr(self.node, attr, value)
+
+    @contextlib.contextmanager
+    def timer(self, stage):
+        """время этапа stage текущего узла; вне узла время учитывается только в суммарном времени этапов"""
+        node = self.node
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.stage_seconds[stage] += seconds
+            if node is not None:
+                node.stages[stage] = node.stages.get(stage, 0) + seconds
+
+    def finish_node(self, tables=None, failure=None):
+        node = self.node
+        if node is None:
+            return
+        self.node = None
+        node.seconds = time.perf_counter() - node.start
+        if tables:
+            node.outcome = 'success'
+            node.n_tables = len(tables)
+        else:
+            node.outcome = 'failure'
+            node.message = failure['message'] if failure else None
+        self.add_node(node)
+
+    def add_node(self, node):
+        """учет завершенного узла, в том числе измеренного в другом процессе"""
+        self.n_nodes += 1
+        self.outcomes[node.outcome] += 1
+        self.seconds_by_type[node.type].append(node.seconds)
+        item = (node.seconds, node.graph_id, node)
+        if len(self.slowest_heap) < self.top_n:
+            heapq.heappush(self.slowest_heap, item)
+        elif item[:2] > self.slowest_heap[0][:2]:
+            heapq.heapreplace(self.slowest_heap, item)
+        for exporter in self.exporters:
+            exporter.write_node(node)
+
+    def merge(self, nodes, stage_seconds):
+        """учет измерений, собранных в процессе-обработчике crawl_graphs"""
+        for node in nodes:
+            self.add_node(node)
+        self.stage_seconds.update(stage_seconds)
+
+    def slowest(self):
+        return [node for _, _, node in sorted(self.slowest_heap, key=lambda item: item[:2], reverse=True)]
+
+    def histogram(self, seconds):
+        """число значений, не превышающих каждую границу buckets, и общее число значений (+Inf)"""
+        counts = [0] * (len(self.buckets) + 1)
+        for value in seconds:
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+        return np.cumsum(counts).tolist()
+
+    def summary(self):
+        by_type = {}
+        for obj_type, seconds in self.seconds_by_type.items():
+            by_type[str(obj_type)] = {
+                'count': len(seconds),
+                'seconds': sum(seconds),
+                'percentiles': dict(zip((f'p{p}' for p in PERCENTILES),
+                                        np.percentile(seconds, PERCENTILES).tolist())),
+                'histogram': dict(zip([str(bucket) for bucket in self.buckets] + ['+Inf'],
+                                      self.histogram(seconds))),
+            }
+        return {
+            'nodes': self.n_nodes,
+            'outcomes': dict(self.outcomes),
+            'stages': dict(self.stage_seconds),
+            'types': by_type,
+            'slowest': [node.to_dict() for node in self.slowest()],
+        }
+
+    def close(self):
+        """передает итоговую сводку exporters и закрывает их файлы"""
+        summary = self.summary()
+        for exporter in self.exporters:
+            exporter.export(summary)
+        for exporter in self.exporters:
+            exporter.close()
+        return summary
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def timer(metrics, stage):
+    """timer для необязательного сбора измерений: при metrics=None ничего не измеряет"""
+    if metrics is None:
+        return contextlib.nullcontext()
+    return metrics.timer(stage)
+
+
+class NodeListExporter:
+    """накопление измерений узлов в списке nodes, например для передачи из процесса-обработчика"""
+
+    def __init__(self):
+        self.nodes = []
+
+    def write_node(self, node):
+        self.nodes.append(node)
+
+    def export(self, summary):
+        pass
+
+    def close(self):
+        pass
+
+
+class JsonLinesExporter:
+    """запись измерений каждого узла строкой JSON в файл path и итоговой сводки в path.summary.json"""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def write_node(self, node):
+        self.file.write(json.dumps(node.to_dict(), ensure_ascii=False, default=str) + '\n')
+
+    def export(self, summary):
+        self.file.flush()
+        with open(f'{self.path}.summary.json', 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2, default=str)
+
+    def close(self):
+        self.file.close()
+
+
+class PrometheusExporter:
+    """запись итоговой сводки в текстовом формате Prometheus (например, для textfile collector node_exporter)"""
+
+    def __init__(self, path, prefix='graph_crawler'):
+        self.path = path
+        self.prefix = prefix
+
+    def write_node(self, node):
+        pass
+
+    def export(self, summary):
+        lines = [f'# TYPE {self.prefix}_nodes_total counter']
+        for outcome, count in summary['outcomes'].items():
+            lines.append(f'{self.prefix}_nodes_total{{outcome="{outcome}"}} {count}')
+        lines.append(f'# TYPE {self.prefix}_stage_seconds_total counter')
+        for stage, seconds in summary['stages'].items():
+            lines.append(f'{self.prefix}_stage_seconds_total{{stage="{stage}"}} {seconds}')
+        lines.append(f'# TYPE {self.prefix}_node_seconds histogram')
+        for obj_type, type_summary in summary['types'].items():
+            label = self.__escape(obj_type)
+            for bucket, count in type_summary['histogram'].items():
+                lines.append(f'{self.prefix}_node_seconds_bucket{{type="{label}",le="{bucket}"}} {count}')
+            lines.append(f'{self.prefix}_node_seconds_sum{{type="{label}"}} {type_summary["seconds"]}')
+            lines.append(f'{self.prefix}_node_seconds_count{{type="{label}"}} {type_summary["count"]}')
+        # файл заменяется целиком, чтобы сборщик не прочитал его наполовину записанным
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, self.path)
+
+    def close(self):
+        pass
+
+    def __escape(self, value):
+        return value.replace('\\', '\\\\').replace('"', '\\"')
@@ -1,63 +1,103 @@
 from abc import ABC, abstractmethod
-import configparser
+import collections
 import io
 import sys
 
 import openpyxl
 import xlrd
 from docx import Document
+from docx.table import Table
+from docx.text.paragraph import Paragraph
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, UnicodeDammit
+import lxml.html
+from lxml import etree
 
 from zipfile import ZipFile
 from zipfile import BadZipfile
 
 from rarfile import RarFile
 from rarfile import BadRarFile, NotRarFile, NeedFirstVolume
+from rarfile import Error as RarError
 
+from concurrent.futures import ThreadPoolExecutor
+
+from src.config import config
 from src.utils import *
 
 
-config = configparser.ConfigParser()
-config.read('config.ini')
 MAX_TABLE_NAME = int(config['tables']['MAX_TABLE_NAME'])
 GRAPH_ERRORS = config['database']['GRAPH_ERRORS'].split(',')
+MAX_ARCHIVE_SIZE = int(config['archives']['MAX_ARCHIVE_SIZE'])
+MAX_ARCHIVE_DEPTH = int(config['archives']['MAX_ARCHIVE_DEPTH'])
+ARCHIVE_WORKERS = int(config['archives']['ARCHIVE_WORKERS'])
+ARCHIVE_EXTS = ('zip', 'rar')
+# элементы HTML, текст которых BeautifulSoup не включает в .text
+HTML_NON_TEXT_TAGS = ('script', 'style', 'template')
+
+# версия парсеров; увеличивается при изменениях, влияющих на результат, чтобы сбросить кэш результатов
+PARSER_VERSION = 5
 
 
 class Parser(ABC):
-    """базовый класс для парсеров документов различных расширений"""
-    tables_info = None
+    """базовый класс для парсеров документов различных расширений;
+    конструктор только сохраняет содержимое, документ разбирается один раз при первом обращении к таблицам;
+    при names_only=True собираются только названия таблиц, n_rows и n_columns равны None"""
     
-    def __init__(self, binary=None, html=None):
+    def __init__(self, binary=None, html=None, names_only=False):
         self.binary = io.BytesIO(binary)
         self.html = html
+        self.names_only = names_only
+        self.tables_info = None
     
-    @abstractmethod
     def get_tables_info(self):
+        """список таблиц документа"""
+        if self.tables_info is None:
+            self.tables_info = list(self.iter_tables())
+        return self.tables_info
+    
+    def iter_tables(self):
+        """таблицы документа по мере разбора; после полного разбора результат запоминается"""
+        if self.tables_info is not None:
+            yield from self.tables_info
+            return
+        tables_info = []
+        for table in self.parse_tables():
+            tables_info.append(table)
+            yield table
+        self.tables_info = tables_info
+    
+    @abstractmethod
+    def parse_tables(self):
+        """генератор таблиц документа; вызывается через iter_tables и get_tables_info"""
         pass
 
 
 class ParserXLSX(Parser):
-    def __init__(self, binary, html):
-        super().__init__(binary, html)
+    def __init__(self, binary, html, read_only=True, names_only=False):
+        super().__init__(binary, html, names_only)
+        # в режиме read_only листы читаются потоково, построчно, без загрузки всей книги в память
+        self.read_only = read_only
+    
+    def parse_tables(self):
+        workbook = None
         try:
-            self.workbook = openpyxl.load_workbook(self.binary)
-            self.tables_info = self.get_tables_info()
+            workbook = openpyxl.load_workbook(self.binary, read_only=self.read_only)
+            for i, worksheet in enumerate(workbook.worksheets):
+                if self.read_only:
+                    yield TableObject(i, *self.__scan_worksheet(worksheet))
+                elif self.names_only:
+                    yield TableObject(i, self.__get_table_name(worksheet))
+                else:
+                    yield TableObject(i, self.__get_table_name(worksheet),
+                                      self.__get_n_rows(worksheet), self.__get_n_columns(worksheet))
         except (TypeError, openpyxl.utils.exceptions.InvalidFileException, OSError, BadZipfile):
             message = str(sys.exc_info()[1])
             raise ValueError(f'xlsx-файл не может быть прочитан ({message})')
-    
-    def get_tables_info(self):
-        tables_info = []
-        for i, worksheet in enumerate(self.workbook.worksheets):
-            table = TableObject(i)
-            table.name = self.__get_table_name(worksheet)
-            table.n_rows = self.__get_n_rows(worksheet)
-            table.n_columns = self.__get_n_columns(worksheet)
-            table.unit = find_unit_in_table_name(table.name)
-            table.number = find_number_in_table_name(table.name)
-            tables_info.append(table)
-        return tables_info
+        finally:
+            # в режиме read_only книга держит zip-архив открытым до close()
+            if workbook is not None:
+                workbook.close()
     
     def __get_table_name(self, worksheet):
         name = ''
@@ -81,6 +121,37 @@ class ParserXLSX(Parser):
         name = clean_text(name)
         return name
 
+    def __scan_worksheet(self, worksheet):
+        """название таблицы, число непустых строк и столбцов листа за один проход по строкам;
+        при names_only чтение листа заканчивается на первой строке после названия"""
+        name = ''
+        is_name_complete = False
+        n_rows = 0
+        non_empty_columns = set()
+        
+        # размеры листа, записанные в файле, могут быть неверными
+        worksheet.reset_dimensions()
+        for row in worksheet.iter_rows(values_only=True):
+            non_empty_cells = [j for j, value in enumerate(row) if value is not None]
+            if not non_empty_cells:
+                continue
+            n_rows += 1
+            non_empty_columns.update(non_empty_cells)
+            
+            # собирать название до тех пор, пока в строке не появится больше одной ячейки с текстом
+            if not is_name_complete:
+                if len(non_empty_cells) <= 1:
+                    name += ''.join(str(row[j]) + ' ' for j in non_empty_cells)
+                else:
+                    is_name_complete = True
+            if is_name_complete and self.names_only:
+                break
+        
+        name = clean_text(name)
+        if self.names_only:
+            return name, None, None
+        return name, n_rows, len(non_empty_columns)
+
     def __get_n_rows(self, worksheet):
         n_rows = 0
         for row in worksheet.rows:
@@ -97,26 +168,26 @@ class ParserXLSX(Parser):
 
 
 class ParserXLS(Parser):
-    def __init__(self, binary, html):
-        super().__init__(binary, html)
+    def __init__(self, binary, html, on_demand=True, names_only=False):
+        super().__init__(binary, html, names_only)
+        # в режиме on_demand листы загружаются по одному и выгружаются после обработки
+        self.on_demand = on_demand
+    
+    def parse_tables(self):
         try:
-            self.workbook = xlrd.open_workbook(file_contents=self.binary.read())
-            self.tables_info = self.get_tables_info()
+            workbook = xlrd.open_workbook(file_contents=self.binary.getvalue(), on_demand=self.on_demand)
+            for i in range(workbook.nsheets):
+                worksheet = workbook.sheet_by_index(i)
+                if self.names_only:
+                    table = TableObject(i, self.__get_table_name(worksheet))
+                else:
+                    table = TableObject(i, self.__get_table_name(worksheet), worksheet.nrows, worksheet.ncols)
+                if self.on_demand:
+                    workbook.unload_sheet(i)
+                yield table
         except xlrd.XLRDError:
             message = str(sys.exc_info()[1])
-            raise ValueError(f'xls-файл не может быть прочитан ({message})')        
-    
-    def get_tables_info(self):
-        tables_info = []
-        for i, worksheet in enumerate(self.workbook.sheets()):
-            table = TableObject(i)
-            table.name = self.__get_table_name(worksheet)
-            table.n_rows = worksheet.nrows
-            table.n_columns = worksheet.ncols
-            table.unit = find_unit_in_table_name(table.name)
-            table.number = find_number_in_table_name(table.name)
-            tables_info.append(table)
-        return tables_info
+            raise ValueError(f'xls-файл не может быть прочитан ({message})')
     
     def __get_table_name(self, worksheet):
         name = ''
@@ -126,59 +197,91 @@ class ParserXLS(Parser):
         
         # собирать название до тех пор, пока в строке не появится больше одной ячейки с текстом
         for i in range(nrows):
-            empty_cells = 0
-            cells_text = ''
-            for j in range(ncols):
-                # Cell Types: 0=Empty, 1=Text, 2=Number, 3=Date, 4=Boolean, 5=Error, 6=Blank
-                if worksheet.cell_type(rowx=i, colx=j) == 0:
-                    empty_cells += 1
-                elif worksheet.cell_type(rowx=i, colx=j) == 1:
-                    cells_text += worksheet.cell_value(rowx=i, colx=j) + ' '
-            if empty_cells >= ncols - 1:
-                name += cells_text
-            else:
+            # Cell Types: 0=Empty, 1=Text, 2=Number, 3=Date, 4=Boolean, 5=Error, 6=Blank
+            row_types = worksheet.row_types(i)
+            empty_cells = row_types.count(xlrd.XL_CELL_EMPTY)
+            if empty_cells < ncols - 1:
                 break
+            row_values = worksheet.row_values(i)
+            name += ''.join(value + ' ' for cell_type, value in zip(row_types, row_values)
+                            if cell_type == xlrd.XL_CELL_TEXT)
         
         name = clean_text(name)
         return name
 
 
 class ParserDOCX(Parser):
-    def __init__(self, binary, html):
-        super().__init__(binary, html)
+    def __init__(self, binary, html, streaming=True, names_only=False):
+        super().__init__(binary, html, names_only)
+        # в режиме streaming word/document.xml читается потоково, без построения объектной модели python-docx
+        self.streaming = streaming
+    
+    def parse_tables(self):
         try:
-            self.document = Document(self.binary)
-            self.tables_info = self.get_tables_info()
-        except (ValueError, BadZipfile):
+            if self.streaming:
+                blocks = self.__iterate_blocks_xml(ZipFile(self.binary, 'r'))
+            else:
+                blocks = self.__iterate_blocks_docx(Document(self.binary))
+            for i, (table_name, table_size) in enumerate(self.__get_table_name(blocks)):
+                yield TableObject(i, table_name, *table_size)
+        except (ValueError, KeyError, BadZipfile, etree.XMLSyntaxError):
             message = str(sys.exc_info()[1])
             raise ValueError(f'docx-файл не может быть прочитан ({message})')
     
-    def get_tables_info(self):
-        tables_info = []
-        
-        tables = self.document.tables
-        table_names = self.__get_table_name(self.document)
-        
-        for i, tbl in enumerate(tables):
-            table = TableObject(i)
-            table.name = table_names[i]
-            table.n_rows = len(tbl.rows)
-            table.n_columns = len(tbl.columns)
-            table.unit = find_unit_in_table_name(table.name)
-            table.number = find_number_in_table_name(table.name)
-            tables_info.append(table)
-        
-        return tables_info
+    def __get_document_xml_name(self, docx_file):
+        # основной документ указан в связях пакета, обычно это word/document.xml
+        with docx_file.open('_rels/.rels') as rels_xml:
+            for relationship in etree.parse(rels_xml).getroot():
+                if relationship.get('Type', '').endswith('/officeDocument'):
+                    return relationship.get('Target').lstrip('/')
+        raise ValueError('основной документ не найден')
     
-    def __get_table_name(self, document):
-        table_names = []
-        previous_text = []
-        
+    def __iterate_blocks_docx(self, document):
         for block in iterate_paragraphs_and_tables(document):
             if isinstance(block, Paragraph):
-                text = clean_text(block.text)
-                previous_text.append(text)
+                yield clean_text(block.text), None
+            elif self.names_only:
+                yield None, (None, None)
             elif isinstance(block, Table):
+                yield None, (len(block.rows), len(block.columns))
+    
+    def __iterate_blocks_xml(self, docx_file):
+        n_rows = n_columns = None if self.names_only else 0
+        # при names_only строки и сетка таблиц не нужны
+        tags = (W_P, W_TBL) if self.names_only else (W_P, W_TBL, W_TR, W_TBLGRID)
+        with docx_file.open(self.__get_document_xml_name(docx_file)) as document_xml:
+            for _, elm in etree.iterparse(document_xml, events=('end',), tag=tags):
+                parent = elm.getparent()
+                # строки и сетка таблиц, расположенных непосредственно в теле документа
+                if elm.tag in (W_TR, W_TBLGRID):
+                    if parent.getparent().tag == W_BODY:
+                        if elm.tag == W_TR:
+                            n_rows += 1
+                            elm.clear()
+                        else:
+                            n_columns = len(elm.findall(W_GRIDCOL))
+                    continue
+                # абзацы и таблицы внутри ячеек таблиц пропускаем, как и python-docx
+                if parent.tag != W_BODY:
+                    continue
+                if elm.tag == W_P:
+                    yield clean_text(get_paragraph_text(elm)), None
+                else:
+                    yield None, (n_rows, n_columns)
+                    n_rows = n_columns = None if self.names_only else 0
+                # обработанные блоки удаляем, чтобы память не зависела от размера документа
+                elm.clear()
+                while elm.getprevious() is not None:
+                    del parent[0]
+    
+    def __get_table_name(self, blocks):
+        """для каждой таблицы возвращает ее название и размер; blocks — пары (текст, None) или (None, размер таблицы)"""
+        previous_text = []
+        
+        for text, table_size in blocks:
+            if table_size is None:
+                previous_text.append(text)
+            else:
                 table_name = ''
             
                 # собираем название таблицы в обратном порядке, пока не наткнемся на пустую
@@ -202,47 +305,99 @@ class ParserDOCX(Parser):
                     table_name = previous_text[-1]
             
                 table_name = clean_text(table_name)
-                table_names.append(table_name)
+                yield table_name, table_size
                 previous_text = []
-    
-        return table_names
 
 
 class ParserHTM(Parser):
-    def __init__(self, binary, html):
-        super().__init__(binary, html)
+    def __init__(self, binary, html, encoding=None, engine='lxml', names_only=False):
+        super().__init__(binary, html, names_only)
+        # engine='lxml' — однопроходный разбор на lxml, engine='bs4' — разбор через BeautifulSoup
+        if engine not in ('lxml', 'bs4'):
+            raise ValueError(f'неизвестный движок разбора HTML {engine}')
+        self.engine = engine
+        self.encoding = encoding
+    
+    def parse_tables(self):
+        binary = self.binary.getvalue()
+        if self.engine == 'lxml':
+            blocks = self.__iterate_blocks_lxml(self.__load_lxml(binary, self.html, self.encoding))
+        else:
+            blocks = self.__iterate_blocks_bs4(self.__load_bs4(binary, self.html, self.encoding))
+        
+        for i, (table_name, table_size) in enumerate(self.__get_table_name(blocks)):
+            yield TableObject(i, table_name, *table_size)
+    
+    def __load_bs4(self, binary, html, encoding):
         if html:
-            self.soup = BeautifulSoup(html, 'lxml')
+            return BeautifulSoup(html, 'lxml')
         elif binary:
-            self.soup = BeautifulSoup(binary, 'lxml')
+            return BeautifulSoup(binary, 'lxml', from_encoding=encoding)
         else:
             raise ValueError('HTML-код не собран')
-        self.tables_info = self.get_tables_info()
     
-    def get_tables_info(self):
-        tables_info = []
-        
-        tables = self.soup.find_all('table')
-        table_names = self.__get_table_name(self.soup)
-        
-        for i, tbl in enumerate(tables):
-            table = TableObject(i)
-            table.name = table_names[i]
-            table.n_rows = self.__get_table_size(tbl)[0]
-            table.n_columns = self.__get_table_size(tbl)[1]
-            table.unit = find_unit_in_table_name(table.name)
-            table.number = find_number_in_table_name(table.name)
-            tables_info.append(table)
-        
-        return tables_info
+    def __load_lxml(self, binary, html, encoding):
+        if html:
+            # lxml не принимает строки с объявлением кодировки, поэтому передаем байты
+            content = html.encode('utf-8')
+            encoding = 'utf-8'
+        elif binary:
+            content = bytes(binary)
+            if encoding is None:
+                # кодировка не указана в MIME-типе, определяем ее так же, как BeautifulSoup
+                encoding = UnicodeDammit(content, is_html=True).original_encoding
+        else:
+            raise ValueError('HTML-код не собран')
+        try:
+            return lxml.html.document_fromstring(content, parser=lxml.html.HTMLParser(encoding=encoding))
+        except LookupError:
+            # неизвестная кодировка в MIME-типе, определяем кодировку по содержимому;
+            # без явной кодировки libxml2 читал бы документ как latin-1
+            encoding = UnicodeDammit(content, is_html=True).original_encoding
+            return lxml.html.document_fromstring(content, parser=lxml.html.HTMLParser(encoding=encoding))
+        except etree.ParserError:
+            # пустой документ
+            return None
     
-    def __get_table_name(self, soup):
-        table_names = []
-        previous_text = []
-        
+    def __iterate_blocks_bs4(self, soup):
         for elm in soup.select('h2, p:not(table p), table'): # css селектор
             if elm.name != 'table':
-                text = clean_text(elm.text)
+                yield clean_text(elm.text), None
+            elif self.names_only:
+                yield None, (None, None)
+            else:
+                yield None, self.__get_table_size_bs4(elm)
+    
+    def __iterate_blocks_lxml(self, root):
+        if root is None:
+            return
+        # элементы обходятся в порядке документа, как и в css селекторе 'h2, p:not(table p), table'
+        for elm in root.iter('h2', 'p', 'table'):
+            if elm.tag == 'table':
+                yield None, (None, None) if self.names_only else self.__get_table_size_lxml(elm)
+            elif elm.tag == 'h2' or next(elm.iterancestors('table'), None) is None:
+                yield clean_text(self.__get_text_lxml(elm)), None
+    
+    def __get_text_lxml(self, elm):
+        """текст элемента без содержимого script, style и template, как .text в BeautifulSoup"""
+        if next(elm.iterancestors(*HTML_NON_TEXT_TAGS), None) is not None:
+            return ''
+        if next(elm.iter(*HTML_NON_TEXT_TAGS), None) is None:
+            return ''.join(elm.itertext())
+        text = [elm.text or '']
+        for child in elm:
+            # комментарии в lxml — элементы с нестроковым tag, их текст тоже не учитывается
+            if isinstance(child.tag, str) and child.tag not in HTML_NON_TEXT_TAGS:
+                text.append(self.__get_text_lxml(child))
+            text.append(child.tail or '')
+        return ''.join(text)
+    
+    def __get_table_name(self, blocks):
+        """для каждой таблицы возвращает ее название и размер; blocks — пары (текст, None) или (None, размер таблицы)"""
+        previous_text = []
+        
+        for text, table_size in blocks:
+            if table_size is None:
                 previous_text.append(text)
             else:
                 table_name = ''
@@ -265,84 +420,122 @@ class ParserHTM(Parser):
                     table_name = last_not_empty
                 
                 table_name = clean_text(table_name)
-                table_names.append(table_name)
+                yield table_name, table_size
                 previous_text = []
-        
-        return table_names
     
-    def __get_table_size(self, table):
-        max_rows = len(table.find_all('tr'))
+    def __get_table_size_bs4(self, table):
+        rows = table.find_all('tr')
         max_columns = 0
-        for row in table.find_all('tr'):
+        for row in rows:
             columns = len(row.find_all('td'))
             if columns > max_columns:
                 max_columns = columns
+        return (len(rows), max_columns)
+    
+    def __get_table_size_lxml(self, table):
+        max_rows = 0
+        max_columns = 0
+        for row in table.iter('tr'):
+            max_rows += 1
+            columns = sum(1 for _ in row.iter('td'))
+            if columns > max_columns:
+                max_columns = columns
         return (max_rows, max_columns)
 
 
-class ParserArchive:
-    def __init__(self, binary, html=None):
-        self.binary = io.BytesIO(binary)
-        self.archive_file = self.__load_archive()
-        self.tables_info = []
+class ParserArchive(Parser):
+    def __init__(self, binary, html=None, workers=ARCHIVE_WORKERS, names_only=False):
+        super().__init__(binary, html, names_only)
+        # число потоков для параллельного парсинга файлов архива
+        self.workers = workers
         self.failures = {}
+        self.uncompressed_size = 0
     
-    def __load_archive(self):
+    def __load_archive(self, binary):
         try:
-            self.archive_file = ZipFile(self.binary, 'r')
+            archive_file = ZipFile(binary, 'r')
         except BadZipfile:
             try:
-                self.archive_file = RarFile(self.binary, 'r')
+                archive_file = RarFile(binary, 'r')
             except (BadRarFile, NotRarFile, io.UnsupportedOperation, NeedFirstVolume):
                 message = str(sys.exc_info()[1])
                 raise ValueError(f'архив не может быть прочитан ({message})')
-        return self.archive_file
+        return archive_file
     
-    def get_tables_info(self):
-        for file_name in self.archive_file.namelist():
-            file_ext = self.__get_file_ext(file_name)
-            if file_ext:
+    def parse_tables(self):
+        self.failures = {}
+        self.uncompressed_size = 0
+        
+        members = self.__iterate_members(self.__load_archive(self.binary), '', 0)
+        
+        # нумерация таблиц сквозная по всем файлам архива
+        i = 0
+        for file_name, tables_info, message in self.__parse_members(members):
+            if message is not None:
+                self.failures[file_name] = message
+                continue
+            for table in tables_info:
+                table.idx = i
+                i += 1
+                yield table
+    
+    def __iterate_members(self, archive_file, archive_name, depth):
+        """файлы архива, включая файлы вложенных архивов; каждый файл читается из архива один раз"""
+        for member in archive_file.infolist():
+            file_ext = self.__get_file_ext(member.filename)
+            if member.is_dir() or not file_ext:
+                continue
+            file_name = f'{archive_name}/{member.filename}' if archive_name else member.filename
+            
+            self.uncompressed_size += member.file_size
+            if self.uncompressed_size > MAX_ARCHIVE_SIZE:
+                raise ValueError(f'размер распакованного архива превышает {MAX_ARCHIVE_SIZE} байт')
+            
+            try:
+                binary = archive_file.read(member)
+            except (BadZipfile, RarError, io.UnsupportedOperation, NotImplementedError, RuntimeError):
+                self.failures[file_name] = f'{file_ext}-файл не может быть прочитан из архива'
+                continue
+            
+            # формат определяем по содержимому, расширение учитываем, если формат не распознан
+            file_format = sniff_format(binary)
+            if file_format in ARCHIVE_EXTS or (file_format is None and file_ext in ARCHIVE_EXTS):
+                if depth >= MAX_ARCHIVE_DEPTH:
+                    self.failures[file_name] = f'превышена глубина вложенности архивов ({MAX_ARCHIVE_DEPTH})'
+                    continue
                 try:
-                    self.__append_tables_info(self.archive_file, file_name, file_ext)
-                except TypeError:
-                    message = str(sys.exc_info()[1])
-                    self.failures[file_name] = message
+                    inner_archive_file = self.__load_archive(io.BytesIO(binary))
+                except ValueError:
+                    self.failures[file_name] = f'{file_ext}-архив не может быть прочитан'
                     continue
-        return self.tables_info
+                yield from self.__iterate_members(inner_archive_file, file_name, depth + 1)
+            else:
+                yield file_name, file_ext, file_format, binary
     
-    def __append_tables_info(self, archive_file, inner_file_name, inner_file_ext):
+    def __parse_members(self, members):
+        """результаты парсинга файлов архива по порядку; при workers > 1 файлы читаются по мере освобождения
+        потоков, поэтому в памяти одновременно не больше workers + 1 распакованных файлов"""
+        if self.workers <= 1:
+            yield from map(self.__parse_member, members)
+            return
+        with ThreadPoolExecutor(self.workers) as executor:
+            futures = collections.deque()
+            for member in members:
+                if len(futures) >= self.workers:
+                    yield futures.popleft().result()
+                futures.append(executor.submit(self.__parse_member, member))
+            while futures:
+                yield futures.popleft().result()
+    
+    def __parse_member(self, member):
+        file_name, file_ext, file_format, binary = member
         try:
-            inner_file = archive_file.read(inner_file_name)
-            binary = io.BytesIO(inner_file).read()
-        except (BadZipfile, BadRarFile, NotRarFile, io.UnsupportedOperation):
-            raise TypeError(f'{inner_file_ext}-архив не может быть прочитан')
-        
-        if inner_file_ext == 'zip':
-            file = archive_file.read(inner_file_name)
-            try:
-                file_read = io.BytesIO(file)
-                zip_file = ZipFile(file_read, 'r')
-                for file_name in zip_file.namelist():
-                    file_ext = self.__get_file_ext(file_name)
-                    self.__append_tables_info(zip_file, file_name, file_ext)
-            except BadZipfile:
-                raise TypeError('zip-архив не может быть прочитан')
-            
-        elif inner_file_ext == 'rar':
-            file = archive_file.read(inner_file_name)
-            try:
-                file_read = io.BytesIO(file)
-                rar_file = RarFile(file_read)
-                for file_name in rar_file.namelist():
-                    file_ext = self.__get_file_ext(file_name)
-                    self.__append_tables_info(rar_file, file_name, file_ext)
-            except (BadRarFile, NotRarFile, io.UnsupportedOperation):
-                raise TypeError('rar-архив не может быть прочитан')
-        
-        parser = self.__choose_parser(inner_file_ext)(binary=binary, html=None)
-        tables_info = parser.get_tables_info()
-        for ti in tables_info:
-            self.tables_info.append(ti)
+            parser = self.__choose_parser(file_ext, file_format)
+            tables_info = parser(binary=binary, html=None, names_only=self.names_only).get_tables_info()
+        except (TypeError, ValueError):
+            # ошибка одного файла не прерывает обработку остальных файлов архива
+            return file_name, None, str(sys.exc_info()[1])
+        return file_name, tables_info, None
     
     def __get_file_ext(self, full_file_name):
         full_file_name = full_file_name.lower()
@@ -352,65 +545,129 @@ class ParserArchive:
             file_ext = splitted[-1]
         return file_ext
     
-    def __choose_parser(self, file_ext):
-        parsers_by_ext = {
-            'xlsx': ParserXLSX,
-            'xls': ParserXLS,
-            'docx': ParserDOCX,
-            'zip': ParserArchive,
-            'rar': ParserArchive,
-            'htm': ParserHTM,
-        }
-        
-        if file_ext in parsers_by_ext:
-            return parsers_by_ext[file_ext]
-        else:
+    def __choose_parser(self, file_ext, file_format):
+        parser = parsers_by_format.get(file_format)
+        if parser is None:
+            parser = parsers_by_ext.get(file_ext)
+        if parser is None or parser is ParserArchive:
             raise TypeError(f'подходящий парсер не найден (расширение {file_ext})')
+        return parser
 
 
 class TableObject:
-    graph_id = None
-    path = None
-    name = None
-    n_rows = None
-    n_columns = None
-    unit = None
-    number = None
-
-    def __init__(self, idx):
+    """сведения о таблице документа; unit и number извлекаются из названия"""
+
+    __slots__ = ('idx', 'name', 'n_rows', 'n_columns', 'unit', 'number', 'graph_id', 'path')
+
+    def __init__(self, idx, name=None, n_rows=None, n_columns=None):
         self.idx = idx
+        self.name = name
+        self.n_rows = n_rows
+        self.n_columns = n_columns
+        self.unit = find_unit_in_table_name(name) if name is not None else None
+        self.number = find_number_in_table_name(name) if name is not None else None
+        self.graph_id = None
+        self.path = None
+
+    def to_dict(self):
+        return {attr: getattr(self, attr) for attr in self.__slots__}
+
+
+class UnknownContentType(TypeError):
+    """MIME-тип узла не определяет формат; парсер выбирается по содержимому file после его загрузки"""
+    pass
+
+
+# реестр парсеров: по формату содержимого (см. sniff_format), по MIME-типу без параметров и по расширению
+parsers_by_format = {}
+file_types = {}
+parsers_by_ext = {}
+# сигнатуры форматов: функции, проверяющие ContentSample (см. src.utils)
+format_signatures = {}
+
+# MIME-типы, по которым формат определяется только по содержимому
+SNIFFED_TYPES = ('application/octet-stream', 'binary/octet-stream', 'application/force-download',
+                 'application/download', 'application/unknown', '')
 
 
-file_types = {
-    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet': ParserXLSX,
-    'application/vnd.ms-excel': ParserXLS,
-    'application/vnd.openxmlformats-officedocument.wordprocessingml.document': ParserDOCX,
-    'application/zip': ParserArchive,
-    'application/x-zip-compressed': ParserArchive,
-    'application/x-rar-compressed': ParserArchive,
-    'text/html; charset=UTF-8': ParserHTM,
-    'text/html; charset=utf-8': ParserHTM,
-    'text/html; charset="utf-8"': ParserHTM,
-    'text/html; charset=windows-1251': ParserHTM,
-    'text/html; charset=cp1251': ParserHTM,
-    'text/html; charset=koi8-r': ParserHTM,
-    'text/html': ParserHTM,
-    'htm': ParserHTM,
-}
-
-
-def choose_parser(graph_node):
+def register_parser(parser, formats=(), mime_types=(), exts=(), signatures=None):
+    """регистрация класса парсера для форматов содержимого, MIME-типов и расширений файлов;
+    signatures — словарь {формат: функция(ContentSample) -> bool}; сигнатуры проверяются
+    от последней зарегистрированной к первой, поэтому частный формат (xlsx внутри zip) регистрируется после общего"""
+    signatures = signatures or {}
+    for file_format in (*formats, *signatures):
+        parsers_by_format[file_format] = parser
+    for file_format, signature in signatures.items():
+        format_signatures.pop(file_format, None)
+        format_signatures[file_format] = signature
+    for mime_type in mime_types:
+        file_types[mime_type.lower()] = parser
+    for ext in exts:
+        parsers_by_ext[ext.lower()] = parser
+    return parser
+
+
+register_parser(ParserArchive, signatures={'zip': is_zip, 'rar': is_rar}, exts=ARCHIVE_EXTS,
+                mime_types=('application/zip', 'application/x-zip-compressed', 'application/x-rar-compressed',
+                            'application/vnd.rar'))
+register_parser(ParserXLSX, signatures={'xlsx': is_xlsx}, exts=('xlsx',),
+                mime_types=('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',))
+register_parser(ParserXLS, signatures={'xls': is_xls}, exts=('xls',),
+                mime_types=('application/vnd.ms-excel',))
+register_parser(ParserDOCX, signatures={'docx': is_docx}, exts=('docx',),
+                mime_types=('application/vnd.openxmlformats-officedocument.wordprocessingml.document',))
+register_parser(ParserHTM, signatures={'htm': is_htm}, exts=('htm', 'html'),
+                mime_types=('text/html',))
+
+
+def sniff_format(binary, html=None):
+    """формат содержимого по зарегистрированным сигнатурам или None, если формат не распознан"""
+    sample = ContentSample(binary, html)
+    for file_format, signature in reversed(format_signatures.items()):
+        if signature(sample):
+            return file_format
+    return None
+
+
+def sniff_parser(binary, html=None):
+    """класс парсера по сигнатуре содержимого или None, если формат не распознан"""
+    return parsers_by_format.get(sniff_format(binary, html))
+
+
+def find_parser(graph_node):
+    """выбор класса парсера: по содержимому file, если оно уже загружено, иначе по MIME-типу и расширению;
+    для узлов с MIME-типом из SNIFFED_TYPES до загрузки содержимого вызывает UnknownContentType"""
     obj_type = graph_node.type
     obj_path = graph_node.path
     obj_ext = obj_path.split('.')[-1].lower()
-    obj_binary = graph_node.file
-    obj_html = graph_node.document
+    # параметры MIME-типа, например charset, на выбор парсера не влияют
+    obj_mime_type = (obj_type or '').split(';')[0].strip().lower()
     
     if obj_type in GRAPH_ERRORS:
         raise TypeError(f'узел графа не собран ({obj_type})')
-    elif obj_type in file_types:
-        return file_types[obj_type](obj_binary, obj_html)
-    elif obj_ext in file_types:
-        return file_types[obj_ext](obj_binary, obj_html)
+    if graph_node.blobs_loaded:
+        parser = sniff_parser(graph_node.file, graph_node.document)
+        if parser is not None:
+            return parser
+    if obj_mime_type in file_types:
+        return file_types[obj_mime_type]
+    elif obj_ext in parsers_by_ext:
+        return parsers_by_ext[obj_ext]
+    elif obj_mime_type in SNIFFED_TYPES and not graph_node.blobs_loaded:
+        raise UnknownContentType(f'формат определяется по содержимому (тип объекта {obj_type})')
     else:
         raise TypeError(f'подходящий парсер не найден (тип объекта {obj_type}, расширение {obj_ext})')
+
+
+def choose_parser(graph_node, names_only=False):
+    parser = find_parser(graph_node)
+    return create_parser(parser, graph_node, names_only)
+
+
+def create_parser(parser, graph_node, names_only=False):
+    obj_binary = graph_node.file
+    obj_html = graph_node.document
+    if parser is ParserHTM:
+        # кодировку HTML берем из MIME-типа узла, например 'text/html; charset=windows-1251'
+        return parser(obj_binary, obj_html, encoding=find_charset(graph_node.type), names_only=names_only)
+    return parser(obj_binary, obj_html, names_only=names_only)
@@ -0,0 +1,184 @@
+import asyncio
+import concurrent.futures
+
+from src.cache import ResultCache
+from src.config import config
+from src.connector import Graph, GraphNode, GRAPH_METADATA, BATCH_SIZE
+from src.crawler import extract_tables, needs_parsing
+from src.metrics import CrawlMetrics, NodeListExporter, timer
+from src.utils import chunked
+
+
+QUEUE_SIZE = int(config['pipeline']['QUEUE_SIZE'])
+MEMORY_LIMIT = int(config['pipeline']['MEMORY_LIMIT'])
+
+# кэш результатов в процессе-обработчике асинхронного обхода
+worker_cache = None
+
+
+class ByteBudget:
+    """ограничение суммарного размера загруженного содержимого узлов; размер, превышающий limit,
+    выделяется, только когда все остальное содержимое уже освобождено"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.condition = asyncio.Condition()
+
+    def try_acquire(self, size):
+        if self.used > 0 and self.used + size > self.limit:
+            return False
+        self.used += size
+        return True
+
+    async def acquire(self, size):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.try_acquire(size))
+
+    async def release(self, size):
+        async with self.condition:
+            self.used -= size
+            self.condition.notify_all()
+
+
+def crawl_pipeline(ids, sink, workers=None, batch_size=BATCH_SIZE, queue_size=QUEUE_SIZE,
+                   memory_limit=MEMORY_LIMIT, cache_path=None, graph_factory=Graph, metrics=None):
+    """асинхронный обход узлов графа с записью результатов в приемник sink (см. src.sink);
+    в Jupyter, где цикл событий уже запущен, вместо этой функции нужно вызывать await crawl_async(...)"""
+    return asyncio.run(crawl_async(ids, sink, workers, batch_size, queue_size, memory_limit,
+                                   cache_path, graph_factory, metrics))
+
+
+async def crawl_async(ids, sink, workers=None, batch_size=BATCH_SIZE, queue_size=QUEUE_SIZE,
+                      memory_limit=MEMORY_LIMIT, cache_path=None, graph_factory=Graph, metrics=None):
+    """обход в три этапа, которые выполняются одновременно: чтение записей и содержимого узлов из базы данных
+    в отдельном потоке, парсинг в workers процессах и запись результатов в приемник в отдельном потоке;
+    этапы связаны очередью из queue_size узлов, а содержимое загружается, пока его суммарный размер
+    не превышает memory_limit байт; результаты записываются в порядке ids (для диапазона — по возрастанию id);
+    graph_factory создает подключение к графу в потоке чтения"""
+    processed_ids = sink.processed_ids()
+    if processed_ids:
+        ids = [graph_id for graph_id in ids if graph_id not in processed_ids]
+
+    queue = asyncio.Queue(maxsize=queue_size)
+    budget = ByteBudget(memory_limit)
+    # подключения к графу и кэшу используются только в потоке, в котором созданы
+    reader_executor = concurrent.futures.ThreadPoolExecutor(1)
+    writer_executor = concurrent.futures.ThreadPoolExecutor(1)
+    parser_executor = concurrent.futures.ProcessPoolExecutor(workers, initializer=init_pipeline_worker,
+                                                             initargs=(cache_path,))
+    try:
+        await asyncio.gather(
+            read_graph_nodes(ids, queue, budget, reader_executor, parser_executor,
+                             batch_size, cache_path, graph_factory, metrics),
+            write_results(sink, queue, budget, writer_executor, metrics),
+        )
+    finally:
+        parser_executor.shutdown(cancel_futures=True)
+        reader_executor.shutdown()
+        writer_executor.shutdown()
+
+
+async def read_graph_nodes(ids, queue, budget, reader_executor, parser_executor,
+                           batch_size=BATCH_SIZE, cache_path=None, graph_factory=Graph, metrics=None):
+    loop = asyncio.get_running_loop()
+    graph, cache = await loop.run_in_executor(reader_executor, open_graph, graph_factory, cache_path)
+    batches = chunked(graph.iter_graph_records(ids, batch_size=batch_size, lazy=True), batch_size)
+    while True:
+        with timer(metrics, 'fetch'):
+            graph_nodes = await loop.run_in_executor(reader_executor, fetch_graph_nodes, batches, graph, cache)
+        if graph_nodes is None:
+            break
+        # узлы, содержимое которых еще не загружено; загружаются одним запросом, пока позволяет budget
+        pending = []
+        for graph_id, graph_node, size in graph_nodes:
+            if size > 0 and not budget.try_acquire(size):
+                await submit_graph_nodes(pending, queue, graph, reader_executor, parser_executor, metrics)
+                pending = []
+                await budget.acquire(size)
+            pending.append((graph_id, graph_node, size))
+        await submit_graph_nodes(pending, queue, graph, reader_executor, parser_executor, metrics)
+    await queue.put(None)
+
+
+async def submit_graph_nodes(pending, queue, graph, reader_executor, parser_executor, metrics=None):
+    loop = asyncio.get_running_loop()
+    graph_nodes = [graph_node for _, graph_node, size in pending if size > 0]
+    with timer(metrics, 'load_blobs'):
+        await loop.run_in_executor(reader_executor, graph.load_blobs, graph_nodes)
+    for graph_id, graph_node, size in pending:
+        graph_record = get_graph_node_record(graph_node) if graph_node is not None else None
+        future = loop.run_in_executor(parser_executor, parse_graph_record, graph_id, graph_record,
+                                      metrics is not None)
+        # при заполненной очереди чтение ждет, пока запись не догонит парсинг
+        await queue.put((future, size))
+
+
+async def write_results(sink, queue, budget, writer_executor, metrics=None):
+    loop = asyncio.get_running_loop()
+    while True:
+        item = await queue.get()
+        if item is None:
+            break
+        future, size = item
+        tables, failure, nodes, stage_seconds = await future
+        await budget.release(size)
+        if metrics is not None:
+            metrics.merge(nodes, stage_seconds)
+        with timer(metrics, 'write'):
+            await loop.run_in_executor(writer_executor, sink.write, tables, failure)
+    with timer(metrics, 'write'):
+        await loop.run_in_executor(writer_executor, sink.flush)
+
+
+def open_graph(graph_factory=Graph, cache_path=None):
+    graph = graph_factory()
+    cache = ResultCache(cache_path) if cache_path is not None else None
+    return graph, cache
+
+
+def fetch_graph_nodes(batches, graph, cache=None):
+    """следующий пакет узлов графа с размером содержимого, которое нужно загрузить для парсинга, или None"""
+    batch = next(batches, None)
+    if batch is None:
+        return None
+    graph_nodes = []
+    for graph_id, graph_record in batch:
+        graph_node = GraphNode(graph_record, graph) if graph_record else None
+        size = 0
+        if graph_node is not None and needs_parsing(graph_node, cache):
+            # не меньше 1, чтобы узел с пустым содержимым тоже попал в загрузку
+            size = max((graph_node.file_size or 0) + (graph_node.document_size or 0), 1)
+        graph_nodes.append((graph_id, graph_node, size))
+    return graph_nodes
+
+
+def get_graph_node_record(graph_node):
+    """запись узла графа для передачи в процесс-обработчик, с загруженным содержимым file и document"""
+    graph_record = {attr: getattr(graph_node, attr) for attr in GRAPH_METADATA}
+    graph_record['file_size'] = graph_node.file_size
+    graph_record['document_size'] = graph_node.document_size
+    if graph_node.blobs_loaded:
+        # psycopg2 возвращает bytea как memoryview, который нельзя передать в другой процесс
+        graph_record['file'] = bytes(graph_node.file) if graph_node.file is not None else None
+        graph_record['document'] = graph_node.document
+    return graph_record
+
+
+def init_pipeline_worker(cache_path=None):
+    global worker_cache
+    if cache_path is not None:
+        worker_cache = ResultCache(cache_path)
+
+
+def parse_graph_record(graph_id, graph_record, collect_metrics=False):
+    """результат extract_tables для узла графа и, при collect_metrics, его измерения и время этапов"""
+    graph_node = GraphNode(graph_record) if graph_record is not None else None
+    if not collect_metrics:
+        return (*extract_tables(graph_id, graph_node, worker_cache), [], {})
+    exporter = NodeListExporter()
+    metrics = CrawlMetrics(exporters=[exporter])
+    metrics.start_node(graph_id, graph_node)
+    tables, failure = extract_tables(graph_id, graph_node, worker_cache, metrics)
+    metrics.finish_node(tables, failure)
+    return tables, failure, exporter.nodes, dict(metrics.stage_seconds)
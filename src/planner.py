@@ -0,0 +1,152 @@
+import datetime
+import json
+
+import pandas as pd
+
+from src.connector import Graph
+from src.parsers import GRAPH_ERRORS, SNIFFED_TYPES, file_types, parsers_by_ext
+from src.utils import to_list
+
+
+# столбцы плана обхода и их типы
+PLAN_DTYPES = {
+    'id': 'int64',
+    'type': 'object',
+    'path': 'object',
+    'hash': 'object',
+    'file_size': 'Int64',
+    'document_size': 'Int64',
+    'n_duplicates': 'int64',
+}
+
+
+class CrawlPlan:
+    """план обхода графа: узлы, которые нужно обработать, по убыванию размера содержимого,
+    и условия отбора, по которым план построен; сохраняется в JSON, чтобы обход можно было повторить или продолжить"""
+
+    def __init__(self, nodes, filters=None, created=None):
+        self.nodes = pd.DataFrame(nodes, columns=list(PLAN_DTYPES)).astype(PLAN_DTYPES)
+        self.filters = dict(filters or {})
+        self.created = created or datetime.datetime.now().isoformat(timespec='seconds')
+
+    @property
+    def ids(self):
+        """id узлов в порядке обработки; передаются в crawl_to_sink, crawl_graphs или crawl_pipeline"""
+        return self.nodes['id'].tolist()
+
+    @property
+    def total_size(self):
+        return int(self.nodes['file_size'].fillna(0).sum() + self.nodes['document_size'].fillna(0).sum())
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def remaining(self, processed_ids):
+        """план из еще не обработанных узлов; processed_ids — множество id или приемник результатов (см. src.sink)"""
+        if hasattr(processed_ids, 'processed_ids'):
+            processed_ids = processed_ids.processed_ids()
+        nodes = self.nodes[~self.nodes['id'].isin(list(processed_ids))]
+        return CrawlPlan(nodes, self.filters, self.created)
+
+    def save(self, path):
+        data = {
+            'created': self.created,
+            'filters': self.filters,
+            'nodes': self.nodes.astype(object).where(self.nodes.notna(), None).values.tolist(),
+        }
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, default=str)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(data['nodes'], data['filters'], data['created'])
+
+
+def plan_crawl(graph=None, rootname=None, level=None, start=None, end=None, subtree=None, ids=None,
+               unique_hashes=True):
+    """план обхода по метаданным public.graph, отобранным одним запросом без чтения содержимого узлов:
+    пропускаются узлы с ошибками сбора (GRAPH_ERRORS), узлы, для которых нет парсера,
+    и, при unique_hashes, повторы содержимого с одинаковым hash (остается узел с наименьшим id);
+    rootname и level — значение или список значений, [start, end) — интервал timestamp,
+    subtree — URL узла, только потомки которого (и он сам) попадают в план,
+    ids — id узлов, из которых строится план, например отобранные GraphTopology (см. src.topology)"""
+    if graph is None:
+        graph = Graph()
+    filters = {
+        'rootname': to_list(rootname),
+        'level': to_list(level),
+        'start': start,
+        'end': end,
+        'subtree': subtree,
+        'ids': to_list(ids),
+        'unique_hashes': unique_hashes,
+    }
+    query, params = generate_query_to_plan(**filters)
+    cursor = graph.connector.cursor()
+    try:
+        cursor.execute(query, params)
+        nodes = cursor.fetchall()
+    finally:
+        cursor.close()
+    return CrawlPlan(nodes, filters)
+
+
+def generate_query_to_plan(rootname=None, level=None, start=None, end=None, subtree=None, ids=None,
+                           unique_hashes=True):
+    # MIME-тип без параметров и расширение вычисляются так же, как в find_parser
+    mime_type = "lower(trim(split_part(coalesce(public.graph.type, ''), ';', 1)))"
+    file_ext = "lower(regexp_replace(public.graph.path, '^.*\\.', ''))"
+    conditions = [
+        "coalesce(public.graph.type, '') <> ALL(%(errors)s)",
+        f'({mime_type} = ANY(%(mime_types)s) OR {file_ext} = ANY(%(exts)s))',
+    ]
+    params = {
+        'errors': GRAPH_ERRORS,
+        'mime_types': list(file_types) + list(SNIFFED_TYPES),
+        'exts': list(parsers_by_ext),
+    }
+    if rootname:
+        conditions.append('public.graph.rootname = ANY(%(rootname)s)')
+        params['rootname'] = rootname
+    if level:
+        conditions.append('public.graph.level = ANY(%(level)s)')
+        params['level'] = level
+    if ids is not None:
+        conditions.append('public.graph.id = ANY(%(ids)s)')
+        params['ids'] = ids
+    if start is not None:
+        conditions.append('public.graph.timestamp >= %(start)s')
+        params['start'] = start
+    if end is not None:
+        conditions.append('public.graph.timestamp < %(end)s')
+        params['end'] = end
+
+    query_to_plan = ''
+    if subtree is not None:
+        # UNION вместо UNION ALL отбрасывает уже найденные URL, поэтому циклы в графе не зацикливают запрос
+        query_to_plan += ('WITH RECURSIVE subtree (path) AS ('
+                          'SELECT %(subtree)s::text '
+                          'UNION '
+                          'SELECT public.graph.path FROM public.graph '
+                          'JOIN subtree ON public.graph.parent = subtree.path) ')
+        conditions.append('public.graph.path IN (SELECT path FROM subtree)')
+        params['subtree'] = subtree
+
+    query_to_plan += ('SELECT id, type, path, hash, file_size, document_size, n_duplicates FROM ('
+                      'SELECT public.graph.id, public.graph.type, public.graph.path, public.graph.hash, '
+                      'octet_length(public.graph.file) AS file_size, '
+                      'octet_length(public.graph.document) AS document_size, '
+                      'CASE WHEN public.graph.hash IS NULL THEN 1 '
+                      'ELSE count(*) OVER (PARTITION BY public.graph.hash) END AS n_duplicates, '
+                      'row_number() OVER (PARTITION BY public.graph.hash ORDER BY public.graph.id) AS hash_rank '
+                      'FROM public.graph '
+                      f'WHERE {" AND ".join(conditions)}'
+                      ') AS nodes ')
+    if unique_hashes:
+        query_to_plan += 'WHERE hash IS NULL OR hash_rank = 1 '
+    # крупные узлы в начале плана, чтобы процессы не ждали последний большой файл в конце обхода
+    query_to_plan += 'ORDER BY coalesce(file_size, 0) + coalesce(document_size, 0) DESC, id;'
+    return query_to_plan, params
+
@@ -0,0 +1,245 @@
+import glob
+import io
+import os
+import os.path
+
+import pandas as pd
+
+from src.config import config
+from src.connector import Graph
+
+
+SINK_BATCH_SIZE = int(config['crawler']['SINK_BATCH_SIZE'])
+TABLES_TABLE = config['database']['TABLES_TABLE']
+FAILURES_TABLE = config['database']['FAILURES_TABLE']
+
+# схемы результатов обхода графа
+SUCCESS_DTYPES = {
+    'graph_id': 'int64',
+    'path': 'string',
+    'idx': 'int64',
+    'name': 'string',
+    'n_rows': 'Int64',
+    'n_columns': 'Int64',
+    'unit': 'string',
+    'number': 'string',
+}
+FAILURE_DTYPES = {
+    'graph_id': 'int64',
+    'path': 'string',
+    'message': 'string',
+}
+# типы столбцов тех же схем в PostgreSQL
+SQL_TYPES = {
+    'int64': 'bigint',
+    'Int64': 'bigint',
+    'string': 'text',
+}
+
+
+def table_to_record(table):
+    """запись о таблице по схеме SUCCESS_DTYPES; пустые строки заменяются на None, как в crawl_graph"""
+    record = {}
+    for attr in SUCCESS_DTYPES:
+        value = getattr(table, attr)
+        if isinstance(value, str) and value.strip() == '':
+            value = None
+        record[attr] = value
+    return record
+
+
+class ResultSink:
+    """базовый класс для приемников результатов обхода графа; записи накапливаются и сбрасываются пакетами"""
+
+    def __init__(self, batch_size=SINK_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.success_records = []
+        self.failure_records = []
+
+    def write(self, tables, failure):
+        """принимает результат extract_tables: пару (таблицы, None) или (None, описание ошибки)"""
+        if tables:
+            records = [table_to_record(table) for table in tables]
+            # таблицы без названия опускаются, как в crawl_graph
+            records = [record for record in records if record['name'] is not None]
+            if records:
+                self.success_records.extend(records)
+            else:
+                # узел без таблиц с названием записывается как ошибка, чтобы попасть в processed_ids
+                self.failure_records.append({'graph_id': tables[0].graph_id, 'path': tables[0].path,
+                                             'message': 'таблицы в файле не найдены'})
+        elif failure is not None:
+            self.failure_records.append(failure)
+        if len(self.success_records) + len(self.failure_records) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.success_records:
+            self.write_success(self.__build_dataframe(self.success_records, SUCCESS_DTYPES))
+            self.success_records = []
+        if self.failure_records:
+            self.write_failure(self.__build_dataframe(self.failure_records, FAILURE_DTYPES))
+            self.failure_records = []
+
+    def write_success(self, df_success):
+        raise NotImplementedError
+
+    def write_failure(self, df_failure):
+        raise NotImplementedError
+
+    def processed_ids(self):
+        """id узлов графа, результаты обхода которых уже записаны"""
+        return set()
+
+    def close(self):
+        self.flush()
+
+    def __build_dataframe(self, records, dtypes):
+        return pd.DataFrame.from_records(records, columns=list(dtypes)).astype(dtypes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class FileResultSink(ResultSink):
+    """запись результатов обхода графа в каталог directory частями в формате csv или parquet
+    (для parquet нужен pyarrow); каждая часть записывается целиком, поэтому прерванный обход
+    можно продолжить, пропустив узлы из processed_ids"""
+
+    def __init__(self, directory, file_format='csv', batch_size=SINK_BATCH_SIZE):
+        super().__init__(batch_size)
+        if file_format not in ('csv', 'parquet'):
+            raise ValueError(f'неизвестный формат файлов {file_format}')
+        self.directory = directory
+        self.file_format = file_format
+        for kind in ('success', 'failure'):
+            os.makedirs(os.path.join(directory, kind), exist_ok=True)
+        self.part_number = len(self.__get_parts('success')) + len(self.__get_parts('failure'))
+
+    def write_success(self, df_success):
+        self.__write_part('success', df_success)
+
+    def write_failure(self, df_failure):
+        self.__write_part('failure', df_failure)
+
+    def read_success(self):
+        return self.__read_parts('success', SUCCESS_DTYPES)
+
+    def read_failure(self):
+        return self.__read_parts('failure', FAILURE_DTYPES)
+
+    def processed_ids(self):
+        processed_ids = set()
+        for kind in ('success', 'failure'):
+            for part in self.__get_parts(kind):
+                processed_ids.update(self.__read_part(part, columns=['graph_id'])['graph_id'])
+        return processed_ids
+
+    def __write_part(self, kind, df):
+        part = os.path.join(self.directory, kind, f'part-{self.part_number:06d}.{self.file_format}')
+        self.part_number += 1
+        # часть сначала пишется во временный файл, чтобы при сбое не осталось недописанных частей
+        tmp_part = part + '.tmp'
+        if self.file_format == 'csv':
+            df.to_csv(tmp_part, index=False)
+        else:
+            df.to_parquet(tmp_part, index=False)
+        os.replace(tmp_part, part)
+
+    def __get_parts(self, kind):
+        return sorted(glob.glob(os.path.join(self.directory, kind, f'part-*.{self.file_format}')))
+
+    def __read_part(self, part, dtypes=None, columns=None):
+        if self.file_format == 'csv':
+            return pd.read_csv(part, dtype=dtypes, usecols=columns)
+        return pd.read_parquet(part, columns=columns)
+
+    def __read_parts(self, kind, dtypes):
+        parts = [self.__read_part(part, dtypes) for part in self.__get_parts(kind)]
+        if not parts:
+            return pd.DataFrame(columns=list(dtypes)).astype(dtypes)
+        return pd.concat(parts, ignore_index=True)
+
+
+class PostgresResultSink(ResultSink):
+    """запись результатов обхода графа в таблицы tables_table и failures_table той же базы данных,
+    что и public.graph; пачки загружаются через COPY во временную таблицу и переносятся в целевую
+    с заменой по (graph_id, idx); при повторной обработке узла его старые записи удаляются;
+    подключение graph не должно одновременно читать узлы графа: commit закрывает его серверные курсоры"""
+
+    def __init__(self, graph=None, tables_table=TABLES_TABLE, failures_table=FAILURES_TABLE,
+                 batch_size=SINK_BATCH_SIZE):
+        super().__init__(batch_size)
+        if graph is None:
+            graph = Graph()
+        self.graph = graph
+        self.tables_table = tables_table
+        self.failures_table = failures_table
+        self.__create_tables()
+
+    def write_success(self, df_success):
+        cursor = self.graph.connector.cursor()
+        self.__copy_to_stage(cursor, 'graph_tables_stage', df_success)
+        # таблицы, которых больше нет в документе, и прежние ошибки обработки тех же узлов
+        cursor.execute(f'DELETE FROM {self.tables_table} AS t '
+                       'USING (SELECT DISTINCT graph_id FROM graph_tables_stage) AS s '
+                       'WHERE t.graph_id = s.graph_id AND NOT EXISTS ('
+                       'SELECT 1 FROM graph_tables_stage AS n WHERE n.graph_id = t.graph_id AND n.idx = t.idx);')
+        cursor.execute(f'DELETE FROM {self.failures_table} '
+                       'WHERE graph_id IN (SELECT graph_id FROM graph_tables_stage);')
+        columns = ', '.join(SUCCESS_DTYPES)
+        updates = ', '.join(f'{column} = EXCLUDED.{column}' for column in SUCCESS_DTYPES
+                            if column not in ('graph_id', 'idx'))
+        cursor.execute(f'INSERT INTO {self.tables_table} ({columns}) '
+                       f'SELECT DISTINCT ON (graph_id, idx) {columns} FROM graph_tables_stage '
+                       f'ON CONFLICT (graph_id, idx) DO UPDATE SET {updates};')
+        self.graph.connector.commit()
+        cursor.close()
+
+    def write_failure(self, df_failure):
+        cursor = self.graph.connector.cursor()
+        self.__copy_to_stage(cursor, 'graph_failures_stage', df_failure)
+        cursor.execute(f'DELETE FROM {self.tables_table} '
+                       'WHERE graph_id IN (SELECT graph_id FROM graph_failures_stage);')
+        columns = ', '.join(FAILURE_DTYPES)
+        cursor.execute(f'INSERT INTO {self.failures_table} ({columns}) '
+                       f'SELECT DISTINCT ON (graph_id) {columns} FROM graph_failures_stage '
+                       'ON CONFLICT (graph_id) DO UPDATE SET path = EXCLUDED.path, message = EXCLUDED.message;')
+        self.graph.connector.commit()
+        cursor.close()
+
+    def processed_ids(self):
+        cursor = self.graph.connector.cursor()
+        cursor.execute(f'SELECT graph_id FROM {self.tables_table} '
+                       f'UNION SELECT graph_id FROM {self.failures_table};')
+        processed_ids = {graph_id for graph_id, in cursor.fetchall()}
+        cursor.close()
+        return processed_ids
+
+    def __create_tables(self):
+        cursor = self.graph.connector.cursor()
+        cursor.execute(f'CREATE TABLE IF NOT EXISTS {self.tables_table} '
+                       f'({self.__generate_columns(SUCCESS_DTYPES)}, PRIMARY KEY (graph_id, idx));')
+        cursor.execute(f'CREATE TABLE IF NOT EXISTS {self.failures_table} '
+                       f'({self.__generate_columns(FAILURE_DTYPES)}, PRIMARY KEY (graph_id));')
+        # промежуточные таблицы для COPY; очищаются в конце каждой транзакции
+        cursor.execute('CREATE TEMP TABLE IF NOT EXISTS graph_tables_stage '
+                       f'({self.__generate_columns(SUCCESS_DTYPES)}) ON COMMIT DELETE ROWS;')
+        cursor.execute('CREATE TEMP TABLE IF NOT EXISTS graph_failures_stage '
+                       f'({self.__generate_columns(FAILURE_DTYPES)}) ON COMMIT DELETE ROWS;')
+        self.graph.connector.commit()
+        cursor.close()
+
+    def __generate_columns(self, dtypes):
+        return ', '.join(f'{column} {SQL_TYPES[dtype]}' for column, dtype in dtypes.items())
+
+    def __copy_to_stage(self, cursor, stage_table, df):
+        # пропущенные значения записываются пустыми полями без кавычек, что в формате csv означает NULL
+        buffer = io.StringIO()
+        df.to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+        columns = ', '.join(df.columns)
+        cursor.copy_expert(f'COPY {stage_table} ({columns}) FROM STDIN WITH (FORMAT csv);', buffer)
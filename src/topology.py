@@ -0,0 +1,184 @@
+import numpy as np
+
+from src.connector import Graph
+from src.utils import to_list
+
+
+# наибольшая длина цепочки перенаправлений; ограничение защищает от циклов
+MAX_REDIRECTS = 20
+
+
+class GraphTopology:
+    """структура графа в памяти: URL заменены целыми номерами, дочерние узлы хранятся в массивах NumPy
+    в формате CSR (для URL u — строки children[indptr[u]:indptr[u + 1]]);
+    позволяет за миллисекунды отбирать id узлов поддерева, уровня и корневого узла для обхода и поиска"""
+
+    def __init__(self, records):
+        """records — кортежи (id, path, parent, redirect, level, rootname) узлов графа"""
+        self.urls = []
+        self.url_index = {}
+        ids, paths, parents, redirects, levels, rootnames = [], [], [], [], [], []
+        for graph_id, path, parent, redirect, level, rootname in records:
+            ids.append(graph_id)
+            paths.append(self.__intern(path))
+            parents.append(self.__intern(parent))
+            redirects.append(self.__intern(redirect))
+            levels.append(level if level is not None else -1)
+            rootnames.append(rootname or '')
+        n_urls = len(self.urls)
+
+        # строки узлов по возрастанию id
+        order = np.argsort(np.asarray(ids, dtype=np.int64), kind='stable')
+        self.ids = np.asarray(ids, dtype=np.int64)[order]
+        self.paths = np.asarray(paths, dtype=np.int32)[order]
+        self.levels = np.asarray(levels, dtype=np.int32)[order]
+        rootname_values, rootname_codes = np.unique(np.asarray(rootnames, dtype=object), return_inverse=True)
+        self.rootnames = rootname_values.tolist()
+        self.rootname_codes = rootname_codes.astype(np.int32)[order]
+        redirects = np.asarray(redirects, dtype=np.int32)[order]
+
+        # URL, с которого произошло перенаправление, указывает на URL узла, в который оно привело
+        self.redirect_targets = np.full(n_urls, -1, dtype=np.int32)
+        has_redirect = (redirects >= 0) & (redirects != self.paths)
+        self.redirect_targets[redirects[has_redirect]] = self.paths[has_redirect]
+        # родительский URL мог быть записан до перенаправления
+        self.parents = self.__resolve_redirects(np.asarray(parents, dtype=np.int32)[order])
+
+        self.children_indptr, self.children = self.__build_csr(self.parents, n_urls)
+        self.path_indptr, self.path_rows = self.__build_csr(self.paths, n_urls)
+
+    @classmethod
+    def from_graph(cls, graph=None):
+        """структура графа, прочитанная из public.graph одним запросом без содержимого узлов"""
+        if graph is None:
+            graph = Graph()
+        cursor = graph.connector.cursor()
+        try:
+            cursor.execute('SELECT public.graph.id, public.graph.path, public.graph.parent, public.graph.redirect, '
+                           'public.graph.level, public.graph.rootname '
+                           'FROM public.graph;')
+            records = cursor.fetchall()
+        finally:
+            cursor.close()
+        return cls(records)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def nbytes(self):
+        """размер массивов структуры в байтах, без строк URL"""
+        arrays = (self.ids, self.paths, self.levels, self.rootname_codes, self.parents, self.redirect_targets,
+                  self.children_indptr, self.children, self.path_indptr, self.path_rows)
+        return sum(array.nbytes for array in arrays)
+
+    def resolve_redirect(self, url):
+        """URL, в который в итоге приводят перенаправления с url"""
+        url_idx = self.url_index.get(url)
+        if url_idx is None:
+            return url
+        return self.urls[self.__resolve_redirects(np.array([url_idx], dtype=np.int32))[0]]
+
+    def find_ids(self, url):
+        """id узлов с адресом url (с учетом перенаправлений)"""
+        return self.ids[self.__find_rows(url)].tolist()
+
+    def children_ids(self, url):
+        """id дочерних узлов страницы url"""
+        return self.descendants(url, max_depth=1, include_self=False)
+
+    def parent_ids(self, url):
+        """id узлов родительской страницы url"""
+        rows = self.__find_rows(url)
+        parents = np.unique(self.parents[rows])
+        parents = parents[parents >= 0]
+        return np.sort(self.ids[self.__get_csr_rows(self.path_indptr, self.path_rows, parents)]).tolist()
+
+    def descendants(self, url, max_depth=None, include_self=True):
+        """id узлов поддерева страницы url по возрастанию, обход в ширину не глубже max_depth переходов"""
+        return self.ids[self.__find_descendant_rows(url, max_depth, include_self)].tolist()
+
+    def select(self, subtree=None, level=None, rootname=None, max_depth=None):
+        """id узлов по возрастанию, отобранных по поддереву страницы subtree, уровню level
+        и корневому узлу rootname (значение или список значений); результат передается в обход или план обхода"""
+        mask = np.ones(len(self.ids), dtype=bool)
+        if subtree is not None:
+            subtree_mask = np.zeros(len(self.ids), dtype=bool)
+            subtree_mask[self.__find_descendant_rows(subtree, max_depth)] = True
+            mask &= subtree_mask
+        if level is not None:
+            mask &= np.isin(self.levels, np.asarray(to_list(level), dtype=np.int32))
+        if rootname is not None:
+            codes = [self.rootnames.index(value) for value in to_list(rootname) if value in self.rootnames]
+            mask &= np.isin(self.rootname_codes, np.asarray(codes, dtype=np.int32))
+        return self.ids[mask].tolist()
+
+    def __find_rows(self, url):
+        url_idx = self.url_index.get(url)
+        if url_idx is None:
+            return np.empty(0, dtype=np.int64)
+        url_idx = self.__resolve_redirects(np.array([url_idx], dtype=np.int32))
+        return self.__get_csr_rows(self.path_indptr, self.path_rows, url_idx)
+
+    def __find_descendant_rows(self, url, max_depth=None, include_self=True):
+        rows = self.__find_rows(url)
+        found = [rows] if include_self else []
+        visited = np.zeros(len(self.urls), dtype=bool)
+        frontier = np.unique(self.paths[rows])
+        frontier = frontier[frontier >= 0]
+        visited[frontier] = True
+        depth = 0
+        while len(frontier) > 0 and (max_depth is None or depth < max_depth):
+            rows = self.__get_csr_rows(self.children_indptr, self.children, frontier)
+            found.append(rows)
+            # страницы, уже встреченные на меньшей глубине, повторно не обходятся, поэтому циклы не мешают обходу
+            frontier = np.unique(self.paths[rows])
+            frontier = frontier[frontier >= 0]
+            frontier = frontier[~visited[frontier]]
+            visited[frontier] = True
+            depth += 1
+        if not found:
+            return np.empty(0, dtype=np.int64)
+        return np.unique(np.concatenate(found))
+
+    def __get_csr_rows(self, indptr, values, url_idx):
+        """значения CSR для всех url_idx без цикла на Python"""
+        starts = indptr[url_idx]
+        lengths = indptr[url_idx + 1] - starts
+        total = int(lengths.sum())
+        if total == 0:
+            return np.empty(0, dtype=np.int64)
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        return values[offsets + np.arange(total)]
+
+    def __resolve_redirects(self, url_idx):
+        url_idx = url_idx.copy()
+        for _ in range(MAX_REDIRECTS):
+            valid = url_idx >= 0
+            targets = np.full(len(url_idx), -1, dtype=np.int32)
+            targets[valid] = self.redirect_targets[url_idx[valid]]
+            redirected = targets >= 0
+            if not redirected.any():
+                break
+            url_idx[redirected] = targets[redirected]
+        return url_idx
+
+    def __build_csr(self, keys, n_urls):
+        valid_rows = np.flatnonzero(keys >= 0)
+        # номера строк и смещения помещаются в int32, пока в графе меньше 2**31 узлов
+        order = valid_rows[np.argsort(keys[valid_rows], kind='stable')].astype(np.int32)
+        counts = np.bincount(keys[valid_rows], minlength=n_urls)
+        indptr = np.zeros(n_urls + 1, dtype=np.int32)
+        np.cumsum(counts, out=indptr[1:])
+        return indptr, order
+
+    def __intern(self, url):
+        if url is None:
+            return -1
+        url_idx = self.url_index.get(url)
+        if url_idx is None:
+            url_idx = len(self.urls)
+            self.url_index[url] = url_idx
+            self.urls.append(url)
+        return url_idx
+
@@ -1,17 +1,59 @@
+import io
+import itertools
 import re
-from docx import Document
-from docx.document import Document as _Document
-from docx.oxml.text.paragraph import CT_P
-from docx.oxml.table import CT_Tbl
-from docx.table import _Cell, Table
-from docx.text.paragraph import Paragraph
+import struct
+from zipfile import ZipFile, BadZipfile
 
 
 ext_regex = re.compile('(\.[a-zA-Z0-9]+?$)')
 number_regex = re.compile('^[\d\.]+')
 table_number_regex = re.compile('^(?:Таблица |Табл. |.{0})([\d\.]*)')
+charset_regex = re.compile('charset="?([\w\-]+)"?', re.IGNORECASE)
 unit_regex = re.compile('\(([^()]*)\)$')
 
+# теги WordprocessingML, используемые при потоковом чтении .docx
+W_NAMESPACE = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+W_BODY = W_NAMESPACE + 'body'
+W_P = W_NAMESPACE + 'p'
+W_TBL = W_NAMESPACE + 'tbl'
+W_TR = W_NAMESPACE + 'tr'
+W_TBLGRID = W_NAMESPACE + 'tblGrid'
+W_GRIDCOL = W_NAMESPACE + 'gridCol'
+W_R = W_NAMESPACE + 'r'
+W_T = W_NAMESPACE + 't'
+W_HYPERLINK = W_NAMESPACE + 'hyperlink'
+W_BR = W_NAMESPACE + 'br'
+W_TYPE = W_NAMESPACE + 'type'
+# текстовые эквиваленты содержимого w:r, как в python-docx
+W_RUN_TEXT = {
+    W_NAMESPACE + 'tab': '\t',
+    W_NAMESPACE + 'ptab': '\t',
+    W_NAMESPACE + 'cr': '\n',
+    W_NAMESPACE + 'noBreakHyphen': '-',
+}
+
+# сигнатуры форматов файлов в первых байтах содержимого
+OLE2_SIGNATURE = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+ZIP_SIGNATURES = (b'PK\x03\x04', b'PK\x05\x06')
+RAR_SIGNATURES = (b'Rar!\x1a\x07\x00', b'Rar!\x1a\x07\x01\x00')
+HTML_MARKERS = (b'<!doctype html', b'<html', b'<head', b'<body', b'<table', b'<meta')
+HTML_SNIFF_SIZE = 1024
+# имена потоков книги Excel в корневом каталоге OLE2, отличают xls от doc и других файлов OLE2
+XLS_STREAMS = ('Workbook', 'Book')
+
+# признак еще не вычисленного свойства ContentSample
+NOT_SNIFFED = object()
+
+# структура заголовка и каталога OLE2 (Compound File Binary)
+OLE2_HEADER_SIZE = 512
+OLE2_DIRECTORY_ENTRY_SIZE = 128
+OLE2_HEADER_DIFAT_SIZE = 109
+OLE2_MAX_REGULAR_SECTOR = 0xFFFFFFFA
+OLE2_NO_STREAM = 0xFFFFFFFF
+OLE2_STREAM = 2
+# ограничение числа просматриваемых элементов каталога для поврежденных файлов
+OLE2_MAX_DIRECTORY_ENTRIES = 4096
+
 
 def clean_text(text):
     text = text.replace('\n', ' ')
@@ -31,6 +73,137 @@ def find_unit_in_table_name(text):
         return match.group(1)
 
 
+def find_charset(content_type):
+    if content_type:
+        match = charset_regex.search(content_type)
+        if match:
+            return match.group(1).lower()
+
+
+class ContentSample:
+    """содержимое файла для проверки сигнатур форматов (см. register_parser в src.parsers);
+    признаки содержимого вычисляются при первом обращении и только для тех сигнатур, которые их используют"""
+
+    def __init__(self, binary, html=None):
+        self.binary = binary
+        self.html = html
+        self.__zip_names = NOT_SNIFFED
+        self.__ole2_streams = None
+
+    @property
+    def head(self):
+        return bytes(self.binary[:HTML_SNIFF_SIZE]) if self.binary else b''
+
+    @property
+    def zip_names(self):
+        """имена файлов zip-архива или None, если содержимое не zip-архив"""
+        if self.__zip_names is NOT_SNIFFED:
+            self.__zip_names = None
+            if self.head.startswith(ZIP_SIGNATURES):
+                try:
+                    self.__zip_names = ZipFile(io.BytesIO(self.binary)).namelist()
+                except BadZipfile:
+                    pass
+        return self.__zip_names
+
+    @property
+    def ole2_streams(self):
+        """имена потоков в корневом каталоге файла OLE2 или пустое множество"""
+        if self.__ole2_streams is None:
+            self.__ole2_streams = read_ole2_root_streams(self.binary) if self.head.startswith(OLE2_SIGNATURE) else set()
+        return self.__ole2_streams
+
+
+def read_ole2_root_streams(binary):
+    """имена потоков корневого каталога OLE2; читаются только заголовок, нужные сектора таблицы FAT и каталога,
+    поэтому время не зависит от размера файла; вложенные каталоги (например, внедренные объекты doc) не учитываются"""
+    if len(binary) < OLE2_HEADER_SIZE:
+        return set()
+    sector_size = 1 << struct.unpack_from('<H', binary, 0x1E)[0]
+    first_directory_sector = struct.unpack_from('<I', binary, 0x30)[0]
+    difat = struct.unpack_from(f'<{OLE2_HEADER_DIFAT_SIZE}I', binary, 0x4C)
+    fat_entries_per_sector = sector_size // 4
+    directory_entries_per_sector = sector_size // OLE2_DIRECTORY_ENTRY_SIZE
+
+    def get_next_sector(sector):
+        fat_sector_idx = sector // fat_entries_per_sector
+        # сектора FAT за пределами заголовка (DIFAT-сектора) не читаем, в файлах xls их практически не бывает
+        if fat_sector_idx >= OLE2_HEADER_DIFAT_SIZE or difat[fat_sector_idx] >= OLE2_MAX_REGULAR_SECTOR:
+            return OLE2_NO_STREAM
+        offset = (difat[fat_sector_idx] + 1) * sector_size + sector % fat_entries_per_sector * 4
+        if offset + 4 > len(binary):
+            return OLE2_NO_STREAM
+        return struct.unpack_from('<I', binary, offset)[0]
+
+    directory_sectors = []
+
+    def read_entry(directory_id):
+        # сектора каталога находятся по цепочке FAT до нужного элемента
+        sector_idx = directory_id // directory_entries_per_sector
+        while len(directory_sectors) <= sector_idx:
+            sector = get_next_sector(directory_sectors[-1]) if directory_sectors else first_directory_sector
+            if sector >= OLE2_MAX_REGULAR_SECTOR:
+                return None
+            directory_sectors.append(sector)
+        offset = ((directory_sectors[sector_idx] + 1) * sector_size
+                  + directory_id % directory_entries_per_sector * OLE2_DIRECTORY_ENTRY_SIZE)
+        if offset + OLE2_DIRECTORY_ENTRY_SIZE > len(binary):
+            return None
+        name_size, entry_type = struct.unpack_from('<HB', binary, offset + 0x40)
+        name = bytes(binary[offset:offset + max(min(name_size, 64) - 2, 0)]).decode('utf-16-le', errors='replace')
+        left, right, child = struct.unpack_from('<3I', binary, offset + 0x44)
+        return name, entry_type, left, right, child
+
+    root = read_entry(0)
+    if root is None:
+        return set()
+    # элементы одного каталога образуют дерево через ссылки left и right, начиная с child родителя
+    streams = set()
+    visited = set()
+    stack = [root[4]]
+    while stack and len(visited) < OLE2_MAX_DIRECTORY_ENTRIES:
+        directory_id = stack.pop()
+        if directory_id == OLE2_NO_STREAM or directory_id in visited:
+            continue
+        visited.add(directory_id)
+        entry = read_entry(directory_id)
+        if entry is None:
+            continue
+        name, entry_type, left, right, _ = entry
+        if entry_type == OLE2_STREAM:
+            streams.add(name)
+        stack.extend((left, right))
+    return streams
+
+
+def is_xls(sample):
+    return any(stream in sample.ole2_streams for stream in XLS_STREAMS)
+
+
+def is_xlsx(sample):
+    # xlsx и docx — zip-архивы, различаются каталогами частей документа
+    return any(name.startswith('xl/') for name in sample.zip_names or ())
+
+
+def is_docx(sample):
+    return any(name.startswith('word/') for name in sample.zip_names or ())
+
+
+def is_zip(sample):
+    return sample.zip_names is not None
+
+
+def is_rar(sample):
+    return sample.head.startswith(RAR_SIGNATURES)
+
+
+def is_htm(sample):
+    if not sample.binary:
+        return bool(sample.html)
+    head = sample.head.lstrip(b'\xef\xbb\xbf \t\r\n').lower()
+    return head.startswith(b'<') and any(marker in head for marker in HTML_MARKERS)
+
+
 def check_starts_with_number(text):
     match = number_regex.search(text)
     if match:
@@ -39,7 +212,68 @@ def check_starts_with_number(text):
         return False
 
 
+def get_paragraph_text(paragraph_elm):
+    """текст абзаца w:p, собранный так же, как Paragraph.text в python-docx"""
+    text = []
+    for child in paragraph_elm:
+        if child.tag == W_R:
+            runs = [child]
+        elif child.tag == W_HYPERLINK:
+            runs = child.findall(W_R)
+        else:
+            continue
+        for run in runs:
+            for item in run:
+                if item.tag == W_T:
+                    text.append(item.text or '')
+                elif item.tag == W_BR:
+                    # разрывы страницы и колонки не дают текста
+                    if item.get(W_TYPE, 'textWrapping') == 'textWrapping':
+                        text.append('\n')
+                elif item.tag in W_RUN_TEXT:
+                    text.append(W_RUN_TEXT[item.tag])
+    return ''.join(text)
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    chunk = list(itertools.islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(itertools.islice(iterator, size))
+
+
+def to_list(value):
+    """список значений условия отбора: значение или коллекция значений; None остается None"""
+    if value is None:
+        return None
+    if isinstance(value, (list, tuple, set, range)) or hasattr(value, 'tolist'):
+        return list(value)
+    return [value]
+
+
+def split_ids(ids, size):
+    """разбиение id узлов графа на порции не больше size; диапазоны делятся на отрезки без материализации,
+    а список id (например, план обхода по убыванию размера из src.planner) — чередованием: в порцию k
+    попадает каждый n-й id начиная с k-го в исходном порядке, поэтому крупные узлы из начала списка
+    оказываются в разных порциях и обрабатываются разными процессами одновременно"""
+    if isinstance(ids, range) and ids.step == 1:
+        for start in range(ids.start, ids.stop, size):
+            yield range(start, min(start + size, ids.stop))
+    else:
+        ids = list(dict.fromkeys(ids))
+        n_chunks = -(-len(ids) // size)
+        for k in range(n_chunks):
+            yield ids[k::n_chunks]
+
+
 def iterate_paragraphs_and_tables(docx_document):
+    from docx.document import Document as _Document
+    from docx.oxml.text.paragraph import CT_P
+    from docx.oxml.table import CT_Tbl
+    from docx.table import Table
+    from docx.text.paragraph import Paragraph
+
     if isinstance(docx_document, _Document):
         docx_document_elm = docx_document.element.body
     else:
@@ -0,0 +1,26 @@
+from src.connector import GRAPH_METADATA, GraphNode
+
+
+class UnencodableDocument(str):
+    def encode(self, *args, **kwargs):
+        raise AssertionError('размер document уже прочитан из базы данных')
+
+
+def make_graph_record(**fields):
+    graph_record = dict.fromkeys(GRAPH_METADATA)
+    graph_record.update(id=1, path='https://rosstat.gov.ru/1.htm')
+    graph_record.update(fields)
+    return graph_record
+
+
+def test_graph_node_keeps_sizes_read_with_metadata():
+    graph_node = GraphNode(make_graph_record(file_size=None, document_size=12))
+    graph_node.set_blobs(None, UnencodableDocument('<p>Таб</p>'))
+    assert graph_node.file_size is None
+    assert graph_node.document_size == 12
+
+
+def test_graph_node_measures_loaded_document_in_bytes():
+    graph_node = GraphNode(make_graph_record(file=b'\x00' * 3, document='<p>Таб</p>'))
+    assert graph_node.file_size == 3
+    assert graph_node.document_size == len('<p>Таб</p>'.encode('utf-8'))
@@ -0,0 +1,43 @@
+import pytest
+
+from benchmarks.graph import SQLiteGraph
+from src.crawler import iter_crawl_results
+from src.utils import split_ids
+
+
+def make_graph():
+    # генератор корпуса записывает xls через xlwt, который указан только в benchmarks/requirements.txt
+    pytest.importorskip('xlwt')
+    from benchmarks.corpus import generate_corpus
+
+    graph_records = generate_corpus(files_per_size=1, sizes={'small': 5}, n_tables=1)
+    graph = SQLiteGraph()
+    graph.insert_graph_records(graph_records)
+    return graph, [graph_record['id'] for graph_record in graph_records]
+
+
+def test_split_ids_stripes_plan():
+    plan_ids = [9, 3, 7, 1, 8, 2, 6, 4, 5]
+    chunks = list(split_ids(plan_ids, 4))
+    assert chunks == [[9, 1, 6], [3, 8, 4], [7, 2, 5]]
+    # крупные узлы из начала плана попадают в разные порции
+    assert [chunk[0] for chunk in chunks] == plan_ids[:3]
+    assert list(split_ids(range(1, 10), 4)) == [range(1, 5), range(5, 9), range(9, 10)]
+
+
+def test_iter_graph_records_keeps_order():
+    graph, ids = make_graph()
+    plan_ids = ids[::-1] + [1000, ids[0]]
+    result_ids = [graph_id for graph_id, _ in graph.iter_graph_records(plan_ids, batch_size=2)]
+    assert result_ids == ids[::-1] + [1000]
+
+
+def test_iter_crawl_results_keeps_plan_order():
+    graph, ids = make_graph()
+    plan_ids = ids[::-1]
+    result_ids = []
+    for tables, failure in iter_crawl_results(plan_ids, batch_size=2, graph=graph):
+        graph_id = tables[0].graph_id if tables else failure['graph_id']
+        if graph_id not in result_ids:
+            result_ids.append(graph_id)
+    assert result_ids == plan_ids
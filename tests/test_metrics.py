@@ -0,0 +1,19 @@
+import json
+
+from src.metrics import CrawlMetrics, JsonLinesExporter, PrometheusExporter
+
+
+def test_metrics_close_writes_summary_and_closes_exporters(tmp_path):
+    exporter = JsonLinesExporter(str(tmp_path / 'crawl.jsonl'))
+    with CrawlMetrics(exporters=[exporter, PrometheusExporter(str(tmp_path / 'crawl.prom'))]) as metrics:
+        metrics.start_node(1)
+        with metrics.timer('parse'):
+            pass
+        metrics.finish_node(None, {'graph_id': 1, 'path': None, 'message': 'ошибка'})
+
+    assert exporter.file.closed
+    nodes = [json.loads(line) for line in (tmp_path / 'crawl.jsonl').read_text(encoding='utf-8').splitlines()]
+    assert [(node['graph_id'], node['outcome'], node['message']) for node in nodes] == [(1, 'failure', 'ошибка')]
+    summary = json.loads((tmp_path / 'crawl.jsonl.summary.json').read_text(encoding='utf-8'))
+    assert summary['outcomes'] == {'failure': 1}
+    assert 'graph_crawler_nodes_total{outcome="failure"} 1' in (tmp_path / 'crawl.prom').read_text(encoding='utf-8')
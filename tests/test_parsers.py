@@ -0,0 +1,167 @@
+import io
+import struct
+import zipfile
+
+import pytest
+
+from src.parsers import (ParserArchive, ParserHTM, ParserXLSX, format_signatures, parsers_by_format,
+                         register_parser, sniff_format, sniff_parser)
+
+
+def parse_html(html, engine, encoding=None):
+    binary = html if isinstance(html, bytes) else None
+    html = None if isinstance(html, bytes) else html
+    return [(table.name, table.n_rows, table.n_columns)
+            for table in ParserHTM(binary, html, encoding=encoding, engine=engine).get_tables_info()]
+
+
+TABLE = '<table><tr><td>1</td><td>2</td></tr><tr><td>3</td></tr></table>'
+
+
+@pytest.mark.parametrize('html', [
+    f'<p>T<script>var x=1;</script>Z</p>{TABLE}',
+    f'<p>A<style>.a {{color: red}}</style>B<!-- комментарий -->C</p>{TABLE}',
+    f'<h2>Раздел<script>if (a < b) {{}}</script></h2><p>Таблица 1<template><b>x</b>y</template></p>{TABLE}',
+    f'<template><p>T</p>{TABLE}</template><p>Таблица 2</p>{TABLE}',
+])
+def test_htm_engines_ignore_script_and_style_text(html):
+    assert parse_html(html, 'lxml') == parse_html(html, 'bs4')
+
+
+@pytest.mark.parametrize('encoding', [None, 'bogus-charset', 'windows-1251'])
+def test_htm_engines_detect_encoding(encoding):
+    html = f'<p>Таблица 1. Численность населения</p>{TABLE}'.encode('cp1251')
+    assert parse_html(html, 'lxml', encoding) == parse_html(html, 'bs4', encoding)
+    assert parse_html(html, 'lxml', encoding)[0][0] == 'Таблица 1. Численность населения'
+
+
+def test_xlsx_workbook_closed_after_parsing(monkeypatch):
+    from openpyxl.workbook.workbook import Workbook
+
+    workbook = Workbook()
+    workbook.active.append(['Таблица 1. Численность населения'])
+    workbook.active.append([1, 2])
+    binary = io.BytesIO()
+    workbook.save(binary)
+
+    closed = []
+    monkeypatch.setattr(Workbook, 'close', lambda self: closed.append(self))
+    tables = ParserXLSX(binary.getvalue(), None).get_tables_info()
+    assert [(table.name, table.n_rows, table.n_columns) for table in tables] == [
+        ('Таблица 1. Численность населения', 2, 2)]
+    assert len(closed) == 1
+
+
+def make_htm_archive(n_files):
+    binary = io.BytesIO()
+    with zipfile.ZipFile(binary, 'w') as archive_file:
+        for i in range(n_files):
+            archive_file.writestr(f'{i:03}.htm', f'<p>Таблица {i}</p>{TABLE}')
+    return binary.getvalue()
+
+
+@pytest.mark.parametrize('workers', [1, 2, 4])
+def test_archive_reads_members_in_bounded_window(monkeypatch, workers):
+    binary = make_htm_archive(20)
+    iterate_members = ParserArchive._ParserArchive__iterate_members
+    pulled = []
+
+    def counting_iterate_members(self, *args):
+        for member in iterate_members(self, *args):
+            pulled.append(member[0])
+            yield member
+
+    monkeypatch.setattr(ParserArchive, '_ParserArchive__iterate_members', counting_iterate_members)
+    tables = []
+    for table in ParserArchive(binary, workers=workers).iter_tables():
+        # таблица каждого файла выдана, а прочитано из архива не больше workers + 1 следующих файлов
+        assert len(pulled) - len(tables) <= workers + 1
+        tables.append((table.idx, table.name, table.n_rows, table.n_columns))
+    assert tables == [(i, f'Таблица {i}', 2, 2) for i in range(20)]
+
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_archive_keeps_members_parsed_before_corrupt_member(workers):
+    corrupt_docx = io.BytesIO()
+    with zipfile.ZipFile(corrupt_docx, 'w') as archive_file:
+        archive_file.writestr('[Content_Types].xml', 'не xml')
+        archive_file.writestr('word/document.xml', 'не xml')
+    binary = io.BytesIO()
+    with zipfile.ZipFile(binary, 'w') as archive_file:
+        archive_file.writestr('000.htm', f'<p>Таблица 0</p>{TABLE}')
+        archive_file.writestr('001.docx', corrupt_docx.getvalue())
+        archive_file.writestr('002.htm', f'<p>Таблица 2</p>{TABLE}')
+
+    parser = ParserArchive(binary.getvalue(), workers=workers)
+    assert [(table.idx, table.name) for table in parser.get_tables_info()] == [(0, 'Таблица 0'), (1, 'Таблица 2')]
+    assert list(parser.failures) == ['001.docx']
+    assert parser.failures['001.docx'].startswith('docx-файл не может быть прочитан')
+
+OLE2_END_OF_CHAIN = 0xFFFFFFFE
+OLE2_FREE_SECTOR = 0xFFFFFFFF
+NO_STREAM = 0xFFFFFFFF
+
+
+def make_ole2(entries, data=b''):
+    """минимальный файл OLE2 с секторами по 512 байт: сектор 0 — FAT, сектор 1 — каталог, далее data;
+    entries — кортежи (имя, тип, left, right, child) не больше четырех элементов каталога"""
+    header = bytearray(512)
+    header[0:8] = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+    struct.pack_into('<HHHHH', header, 0x18, 0x3E, 3, 0xFFFE, 9, 6)
+    struct.pack_into('<III', header, 0x2C, 1, 1, 0)
+    struct.pack_into('<I', header, 0x38, 4096)
+    struct.pack_into('<III', header, 0x3C, OLE2_END_OF_CHAIN, 0, OLE2_END_OF_CHAIN)
+    struct.pack_into('<109I', header, 0x4C, 0, *[OLE2_FREE_SECTOR] * 108)
+    fat = [0xFFFFFFFD, OLE2_END_OF_CHAIN] + [OLE2_FREE_SECTOR] * 126
+    directory = bytearray(512)
+    for i, (name, entry_type, left, right, child) in enumerate(entries):
+        offset = i * 128
+        encoded_name = (name + '\0').encode('utf-16-le')
+        directory[offset:offset + len(encoded_name)] = encoded_name
+        struct.pack_into('<HBB3I', directory, offset + 0x40, len(encoded_name), entry_type, 1, left, right, child)
+    data += b'\0' * (-len(data) % 512)
+    return bytes(header) + struct.pack('<128I', *fat) + bytes(directory) + data
+
+
+def test_sniff_format_reads_ole2_root_directory():
+    workbook = make_ole2([('Root Entry', 5, NO_STREAM, NO_STREAM, 1),
+                          ('Workbook', 2, NO_STREAM, 2, NO_STREAM),
+                          ('\x05SummaryInformation', 2, NO_STREAM, NO_STREAM, NO_STREAM)])
+    assert sniff_format(workbook) == 'xls'
+
+    # документ Word с внедренной книгой Excel и текстом 'Book' в содержимом потока — не xls
+    document = make_ole2([('Root Entry', 5, NO_STREAM, NO_STREAM, 1),
+                          ('WordDocument', 2, NO_STREAM, 2, NO_STREAM),
+                          ('ObjectPool', 1, NO_STREAM, NO_STREAM, 3),
+                          ('Workbook', 2, NO_STREAM, NO_STREAM, NO_STREAM)],
+                         'Book Workbook'.encode('utf-16-le'))
+    assert sniff_format(document) is None
+    assert sniff_format(document[:300]) is None
+
+
+def test_sniff_format_xls_written_by_xlwt():
+    xlwt = pytest.importorskip('xlwt')
+    workbook = xlwt.Workbook()
+    workbook.add_sheet('Лист1').write(0, 0, 'Таблица 1')
+    binary = io.BytesIO()
+    workbook.save(binary)
+    assert sniff_format(binary.getvalue()) == 'xls'
+
+
+def test_register_parser_signature_takes_precedence():
+    class ParserODS(ParserXLSX):
+        pass
+
+    binary = io.BytesIO()
+    with zipfile.ZipFile(binary, 'w') as archive_file:
+        archive_file.writestr('mimetype', 'application/vnd.oasis.opendocument.spreadsheet')
+    binary = binary.getvalue()
+    assert sniff_parser(binary) is ParserArchive
+
+    register_parser(ParserODS, signatures={'ods': lambda sample: 'mimetype' in (sample.zip_names or ())})
+    try:
+        assert sniff_parser(binary) is ParserODS
+    finally:
+        del parsers_by_format['ods']
+        del format_signatures['ods']
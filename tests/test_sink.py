@@ -0,0 +1,22 @@
+from src.parsers import TableObject
+from src.sink import FileResultSink
+
+
+def make_table(graph_id, idx, name):
+    table = TableObject(idx, name, 2, 2)
+    table.graph_id = graph_id
+    table.path = f'https://rosstat.gov.ru/{graph_id}.xlsx'
+    return table
+
+
+def test_node_without_named_tables_is_processed(tmp_path):
+    with FileResultSink(tmp_path) as sink:
+        sink.write([make_table(1, 0, 'Таблица 1'), make_table(1, 1, ' ')], None)
+        sink.write([make_table(2, 0, ''), make_table(2, 1, None)], None)
+        sink.write(None, {'graph_id': 3, 'path': 'https://rosstat.gov.ru/3', 'message': 'ошибка'})
+
+    sink = FileResultSink(tmp_path)
+    assert sink.processed_ids() == {1, 2, 3}
+    assert sink.read_success()['graph_id'].tolist() == [1]
+    df_failure = sink.read_failure()
+    assert df_failure.loc[df_failure['graph_id'] == 2, 'message'].tolist() == ['таблицы в файле не найдены']